@@ -0,0 +1,254 @@
+import os
+import sys
+import glob
+import json
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+from time import perf_counter
+
+import chat
+
+RESULTS_DIR = ".benchmarks"
+
+# Data sizes per preset: total messages, registered users, members of the
+# measured group. --messages/--users/--group-size override a preset.
+SCALES = {
+    "small": {"messages": 1_000, "users": 10, "group_size": 2},
+    "medium": {"messages": 100_000, "users": 1_000, "group_size": 500},
+    "large": {"messages": 1_000_000, "users": 10_000, "group_size": 5_000}
+}
+GROUPS = 10
+# Rows per call in the bulk-vs-single comparisons.
+BULK_ROWS = 100
+
+# ---------------------- SEEDING ---------------------- #
+def user_name(i):
+    return f"user{i}"
+
+def group_name(i):
+    return f"group{i}"
+
+def dataset(scale, seed):
+    # Users, groups and messages as plain tuples. group0 is the measured group
+    # and gets `group_size` members; the others share the remaining traffic.
+    rng = random.Random(seed)
+    users = [user_name(i) for i in range(scale["users"])]
+    groups = {group_name(g): [] for g in range(GROUPS)}
+    groups[group_name(0)] = [user_name(i % len(users)) for i in range(scale["group_size"])]
+    for g in range(1, GROUPS):
+        groups[group_name(g)] = rng.sample(users, min(len(users), 2))
+    groups = {g: list(dict.fromkeys(members)) for g, members in groups.items()}
+    now = str(datetime.datetime.now())
+    messages = []
+    for mid in range(1, scale["messages"] + 1):
+        if rng.random() < 0.5:
+            g = group_name(rng.randrange(GROUPS))
+            messages.append((mid, rng.choice(groups[g]), g, f"message {mid}", now, 1))
+        else:
+            a, b = rng.sample(users, 2) if len(users) > 1 else (users[0], users[0])
+            messages.append((mid, a, b, f"message {mid}", now, 0))
+    return users, groups, messages
+
+def seed_sqlite(users, groups, messages):
+    chat.init_db()
+    password_hash = chat.hash_password("password")
+    now = str(datetime.datetime.now())
+    with chat.get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?)",
+            [(u, password_hash, now) for u in users]
+        )
+        for g, members in groups.items():
+            group_id = conn.execute(
+                "INSERT INTO groups (group_name, created_by, created_at) VALUES (?, ?, ?)",
+                (g, members[0], now)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO group_members (group_id, username) VALUES (?, ?)",
+                [(group_id, m) for m in members]
+            )
+        conn.executemany(
+            "INSERT INTO messages (id, sender, receiver, msg, time, is_group) VALUES (?, ?, ?, ?, ?, ?)",
+            messages
+        )
+    return chat.SQLiteBackend()
+
+def seed_json(users, groups, messages):
+    password_hash = chat.hash_password("password")
+    now = str(datetime.datetime.now())
+    chat.save_data({
+        "users": {u: {"password_hash": password_hash, "created_at": now} for u in users},
+        "groups": {g: {"created_by": members[0], "created_at": now, "members": members} for g, members in groups.items()}
+    })
+    with open(chat.MESSAGES_FILE, "w") as f:
+        for m in messages:
+            f.write(json.dumps(dict(zip(chat.MESSAGE_FIELDS, m)), separators=(",", ":")) + "\n")
+    return chat.JSONBackend()
+
+def seed_memory(users, groups, messages):
+    store = chat.MemoryBackend()
+    password_hash = chat.hash_password("password")
+    now = str(datetime.datetime.now())
+    store.users = {u: {"password_hash": password_hash, "created_at": now} for u in users}
+    for g, members in groups.items():
+        store.groups[g] = {"created_by": members[0], "created_at": now, "members": list(members)}
+        for m in members:
+            store.user_groups.setdefault(m, {})[g] = None
+    for m in messages:
+        store.conversations.setdefault(chat.conversation_key(m[1], m[2], m[5]), []).append(m)
+    store.last_id = len(messages)
+    return store
+
+SEEDERS = {
+    "SQLite": seed_sqlite,
+    "JSON": seed_json,
+    "Memory": seed_memory
+}
+
+# ---------------------- MEASUREMENT ---------------------- #
+def measure(fn, min_time, max_rounds):
+    # Run fn() once to warm caches, then repeatedly until min_time has passed.
+    fn(0)
+    timings = []
+    spent = 0.0
+    while len(timings) < max_rounds and (spent < min_time or len(timings) < 3):
+        started = perf_counter()
+        fn(len(timings) + 1)
+        elapsed = perf_counter() - started
+        timings.append(elapsed)
+        spent += elapsed
+    timings.sort()
+    return {
+        "rounds": len(timings),
+        "min_us": round(timings[0] * 1e6, 2),
+        "median_us": round(timings[len(timings) // 2] * 1e6, 2),
+        "p95_us": round(timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1e6, 2),
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 2)
+    }
+
+def operations(store, users):
+    # Each callable takes the round number, so writes use fresh names.
+    a, b = users[0], users[1 % len(users)]
+    hot_group = group_name(0)
+    latest_id = None
+
+    def get_conversation_since_group(n):
+        # A live chat polling right after its last read: an empty delta. The
+        # cursor is taken on the warm-up call, since the sends measured
+        # before this also add to the group.
+        nonlocal latest_id
+        if latest_id is None:
+            page = store.get_conversation_page(a, hot_group, 1, limit=1)
+            latest_id = page[-1][0] if page else 0
+        return store.get_conversation_since(a, hot_group, 1, latest_id)
+
+    return {
+        "signup": lambda n: store.signup(f"bench{n}", "password"),
+        "login": lambda n: store.login(a, "password"),
+        "logout": lambda n: store.logout(f"bench{n}"),
+        "heartbeat": lambda n: store.heartbeat(users[n % len(users)]),
+        "get_online_users": lambda n: store.get_online_users(),
+        "send_message": lambda n: store.send_message(a, b, f"bench {n}"),
+        "send_message_group": lambda n: store.send_message(a, hot_group, f"bench {n}", is_group=1),
+        "get_conversation": lambda n: store.get_conversation(a, b),
+        "get_conversation_group": lambda n: store.get_conversation(a, hot_group, is_group=1),
+        "get_conversation_page": lambda n: store.get_conversation_page(a, b),
+        "get_conversation_page_group": lambda n: store.get_conversation_page(a, hot_group, is_group=1),
+        "get_conversation_since_group": get_conversation_since_group,
+        # The same BULK_ROWS rows written one call at a time and in one bulk call.
+        "send_message_x100": lambda n: [store.send_message(a, b, f"bench {n}.{i}") for i in range(BULK_ROWS)],
+        "send_messages_x100": lambda n: store.send_messages([(a, b, f"bench {n}.{i}", 0) for i in range(BULK_ROWS)]),
+        "create_group": lambda n: store.create_group(f"bench-group{n}", a),
+        "add_member": lambda n: store.add_member(hot_group, f"bench-member{n}"),
+        "add_member_x100": lambda n: [store.add_member(hot_group, f"bench-single{n}.{i}") for i in range(BULK_ROWS)],
+        "add_members_x100": lambda n: store.add_members(hot_group, [f"bench-bulk{n}.{i}" for i in range(BULK_ROWS)]),
+        "get_user_groups": lambda n: store.get_user_groups(a),
+        "search_messages": lambda n: store.search_messages(a, "message 12")
+    }
+
+def run(backend, scale, args):
+    # Each run seeds a fresh temporary directory and deletes it afterwards.
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix=f"bench-{backend.lower()}-")
+    os.chdir(workdir)
+    try:
+        users, groups, messages = dataset(scale, args.seed)
+        started = perf_counter()
+        store = SEEDERS[backend](users, groups, messages)
+        seeded = perf_counter() - started
+        results = {}
+        for op, fn in operations(store, users).items():
+            if args.only and op not in args.only:
+                continue
+            results[op] = measure(fn, args.min_time, args.max_rounds)
+        if backend == "SQLite":
+            chat.get_pool(os.path.abspath(chat.DB_FILE)).close_all()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"backend": backend, "scale": scale, "seed_sec": round(seeded, 3), "results": results}
+
+# ---------------------- RESULTS ---------------------- #
+def previous_results(results_dir):
+    # The most recent stored timing of every (backend, scale, operation).
+    files = sorted(glob.glob(os.path.join(results_dir, "bench-*.json")))
+    previous = {}
+    for path in files:
+        with open(path) as f:
+            for r in json.load(f):
+                for op, row in r["results"].items():
+                    previous[(r["backend"], json.dumps(r["scale"], sort_keys=True), op)] = row
+    return files[-1] if files else None, previous
+
+def print_run(run_result, previous):
+    scale = run_result["scale"]
+    print(f"\n== {run_result['backend']}: {scale['messages']} messages, {scale['users']} users, "
+          f"group of {scale['group_size']} (seeded in {run_result['seed_sec']}s)")
+    print(f"{'operation':<30}{'rounds':>8}{'median us':>12}{'p95 us':>12}{'vs prev':>10}")
+    for op, row in run_result["results"].items():
+        old = previous.get((run_result["backend"], json.dumps(scale, sort_keys=True), op))
+        change = f"{(row['median_us'] / old['median_us'] - 1) * 100:+.0f}%" if old and old["median_us"] else ""
+        print(f"{op:<30}{row['rounds']:>8}{row['median_us']:>12}{row['p95_us']:>12}{change:>10}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Micro-benchmark every storage operation at several data scales.")
+    parser.add_argument("--backend", nargs="+", default=list(SEEDERS), choices=list(SEEDERS))
+    parser.add_argument("--scale", nargs="+", default=["small"], choices=list(SCALES))
+    parser.add_argument("--messages", type=int, help="override the message count of every scale")
+    parser.add_argument("--users", type=int, help="override the user count of every scale")
+    parser.add_argument("--group-size", type=int, help="override the measured group's member count")
+    parser.add_argument("--only", nargs="+", help="only run these operations")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent measuring each operation")
+    parser.add_argument("--max-rounds", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results-dir", default=os.path.abspath(RESULTS_DIR))
+    parser.add_argument("--no-save", action="store_true", help="do not store this run")
+    args = parser.parse_args(argv)
+
+    previous_file, previous = previous_results(args.results_dir)
+    if previous_file:
+        print(f"Comparing with stored runs up to {previous_file}")
+
+    runs = []
+    for name in args.scale:
+        scale = dict(SCALES[name])
+        for key in ("messages", "users", "group_size"):
+            if getattr(args, key) is not None:
+                scale[key] = getattr(args, key)
+        for backend in args.backend:
+            runs.append(run(backend, scale, args))
+            print_run(runs[-1], previous)
+
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        path = os.path.join(args.results_dir, f"bench-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        with open(path, "w") as f:
+            json.dump(runs, f, indent=4)
+        print(f"\nSaved {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,13 +4,311 @@ import hashlib
 import datetime
 import os
 import json
+import re
+import math
+import copy
+import functools
+import tempfile
+import sys
+import queue
+import socket
+import fcntl
+import logging
+import logging.handlers
+import abc
+import argparse
+import atexit
+import http.server
+import threading
+import concurrent.futures
+from array import array
+from collections import OrderedDict
+from time import monotonic, perf_counter, sleep, time as wall_clock
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 
 DB_FILE = "chat_app.db"
 DATA_FILE = "chat_data.json"
+# Append-only message log for the JSON backend; DATA_FILE keeps users/groups.
+MESSAGES_FILE = "chat_messages.jsonl"
+# Compacted messages folded out of MESSAGES_FILE, stored as rows of MESSAGE_FIELDS.
+MESSAGES_SNAPSHOT_FILE = "chat_messages.snapshot.json"
+MESSAGE_FIELDS = ("id", "sender", "receiver", "msg", "time", "is_group")
+# Inverted index for JSON search: a sorted term dictionary in SEARCH_INDEX_FILE
+# pointing into a postings file of packed message ids (SEARCH_POSTINGS_FILE,
+# one per generation).
+SEARCH_INDEX_FILE = "chat_search_index.json"
+SEARCH_POSTINGS_FILE = "chat_search_index.{}.postings"
+# Posting-list ids kept in memory per process, and how many messages may be
+# indexed in memory only before the compactor persists them. A process whose
+# unpersisted postings pass SEARCH_INDEX_DELTA_LIMIT ids persists them itself.
+SEARCH_INDEX_BUDGET = 2_000_000
+SEARCH_INDEX_FLUSH = 10_000
+SEARCH_INDEX_DELTA_LIMIT = 500_000
+
+# Compact once the log passes this size, or once the last compaction is this
+# old (seconds). The background compactor checks every COMPACT_CHECK_INTERVAL.
+COMPACT_LOG_BYTES = 4 * 1024 * 1024
+COMPACT_MAX_AGE = 6 * 60 * 60
+COMPACT_CHECK_INTERVAL = 60
+
+# Presence: a session counts as online while it heartbeats (the page sends
+# one every PRESENCE_HEARTBEAT seconds) and drops out PRESENCE_TTL seconds
+# after the last one. Set CHAT_PRESENCE_FILE to share presence between
+# processes, and across restarts, through that file.
+PRESENCE_HEARTBEAT = 5
+PRESENCE_TTL = 15
+PRESENCE_FILE = os.environ.get("CHAT_PRESENCE_FILE", "")
+PRESENCE_SYNC_INTERVAL = 2
+
+# Group membership is cached per process and dropped on every change made
+# here; changes made by other processes show up within this many seconds.
+GROUP_CACHE_TTL = 30
+
+# New-message notifications: an open conversation only goes to storage after
+# a message was published on its topic. Set CHAT_BUS_DIR to exchange them
+# between processes over Unix datagram sockets in that directory; without it,
+# open conversations also re-check storage every BUS_RESYNC_INTERVAL seconds
+# to pick up messages sent by other processes.
+BUS_DIR = os.environ.get("CHAT_BUS_DIR", "")
+BUS_RESYNC_INTERVAL = 30
+
+# Storage metrics. Set CHAT_METRICS_PORT to serve Prometheus text on
+# 127.0.0.1:<port>/metrics, and/or CHAT_METRICS_FILE to dump it periodically.
+METRICS_ENABLED = True
+METRICS_PORT = int(os.environ.get("CHAT_METRICS_PORT", "0"))
+METRICS_FILE = os.environ.get("CHAT_METRICS_FILE", "")
+METRICS_DUMP_INTERVAL = 15
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+logger = logging.getLogger("chat")
+
+# Messages fetched per page of conversation history.
+CHAT_PAGE_SIZE = 50
+# Seconds between refreshes of an open conversation.
+CHAT_REFRESH_INTERVAL = 2
+# Search results per page.
+SEARCH_PAGE_SIZE = 10
+SQLITE_MAX_ID = 2 ** 63 - 1
+
+DB_POOL_SIZE = 8
+DB_POOL_TIMEOUT = 10
+DB_STATEMENT_CACHE = 256
+
+# Applied to every pooled connection, in order. WAL lets readers keep going
+# while a writer commits; NORMAL sync is safe under WAL (only the last
+# transactions can be lost on power failure, never corrupted).
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "wal_autocheckpoint": 1000,
+}
+# On top of SQLite's page-count autocheckpoint, run a passive checkpoint
+# from a returning connection at most this often (seconds).
+DB_CHECKPOINT_INTERVAL = 60
+
+# Opt-in slow-query log: set CHAT_SLOW_QUERY_LOG to a file path. Statements
+# slower than SLOW_QUERY_MS are written there as JSON lines with their plan.
+SLOW_QUERY_LOG = os.environ.get("CHAT_SLOW_QUERY_LOG", "")
+SLOW_QUERY_MS = float(os.environ.get("CHAT_SLOW_QUERY_MS", "50"))
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# Optional write-behind for SQLite messages: set CHAT_WRITE_BEHIND=1 to
+# coalesce send_message calls from every session into group commits of up
+# to WRITE_BEHIND_BATCH rows, waiting at most WRITE_BEHIND_DELAY seconds for
+# a batch to fill (CHAT_WRITE_BEHIND_BATCH and CHAT_WRITE_BEHIND_DELAY). Senders
+# still return only once their row is committed.
+WRITE_BEHIND_ENABLED = os.environ.get("CHAT_WRITE_BEHIND", "") == "1"
+WRITE_BEHIND_BATCH = int(os.environ.get("CHAT_WRITE_BEHIND_BATCH", "100"))
+WRITE_BEHIND_DELAY = float(os.environ.get("CHAT_WRITE_BEHIND_DELAY", "0.005"))
+WRITE_BEHIND_ACK_TIMEOUT = 10
 
 # ---------------------- DB FUNCTIONS ---------------------- #
+@st.cache_resource
+def get_slow_query_logger(path=SLOW_QUERY_LOG):
+    slow_logger = logging.getLogger("chat.slow_query")
+    slow_logger.setLevel(logging.INFO)
+    slow_logger.propagate = False
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_logger.addHandler(handler)
+    return slow_logger
+
+def param_shape(params):
+    # Types only; the values may be passwords or message text.
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    return [type(v).__name__ for v in params]
+
+class FetchedCursor:
+    # Rows already read by SlowQueryConnection, served like a cursor.
+    def __init__(self, cursor, rows):
+        self._cursor = cursor
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class SlowQueryConnection(sqlite3.Connection):
+    # Times each statement, including reading its rows, and logs the slow
+    # ones with their EXPLAIN QUERY PLAN.
+    threshold = SLOW_QUERY_MS / 1000
+
+    def execute(self, sql, params=()):
+        started = perf_counter()
+        cursor = super().execute(sql, params)
+        if cursor.description is not None:
+            cursor = FetchedCursor(cursor, cursor.fetchall())
+        self._check(sql, params, perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = perf_counter()
+        cursor = super().executemany(sql, seq_of_params)
+        self._check(sql, seq_of_params[0] if seq_of_params else (), perf_counter() - started, len(seq_of_params))
+        return cursor
+
+    def _check(self, sql, params, elapsed, batch=None):
+        if elapsed < self.threshold:
+            return
+        try:
+            plan = [row[3] for row in super().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+        except sqlite3.Error:
+            plan = None
+        entry = {
+            "time": str(datetime.datetime.now()),
+            "duration_ms": round(elapsed * 1000, 3),
+            "sql": " ".join(sql.split()),
+            "params": param_shape(params),
+            "plan": plan
+        }
+        if batch is not None:
+            entry["batch"] = batch
+        get_slow_query_logger().info(json.dumps(entry))
+
+class ConnectionPool:
+    # Bounded pool of long-lived connections. Idle connections are kept LIFO so
+    # the warmest one (page cache, prepared statements) is handed out first.
+    def __init__(self, db_file, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 pragmas=None, checkpoint_interval=DB_CHECKPOINT_INTERVAL):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self.checkpoint_interval = checkpoint_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._last_checkpoint = monotonic()
+        self._checkpoint_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+            factory=SlowQueryConnection if SLOW_QUERY_LOG else sqlite3.Connection
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            if not self._healthy(conn):
+                conn.close()
+                conn = self._connect()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def checkpoint(self, conn, mode="PASSIVE"):
+        # Returns (busy, wal_pages, checkpointed_pages) as reported by SQLite.
+        with self._checkpoint_lock:
+            self._last_checkpoint = monotonic()
+        return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def _maybe_checkpoint(self, conn):
+        if not self.checkpoint_interval:
+            return
+        if monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint(conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._maybe_checkpoint(conn)
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return
+        self.checkpoint(conn, "TRUNCATE")
+        conn.close()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+@st.cache_resource
+def get_pool(db_file):
+    # Cached as a resource so every session and every rerun shares one pool.
+    # Keyed by absolute path, so changing directory never reuses connections
+    # to another directory's database. On shutdown the WAL is truncated.
+    pool = ConnectionPool(db_file)
+    atexit.register(pool.close_all)
+    return pool
+
 def get_conn():
-    return sqlite3.connect(DB_FILE, check_same_thread=False)
+    return get_pool(os.path.abspath(DB_FILE)).connection()
 
 def init_db():
     with get_conn() as conn:
@@ -48,19 +346,356 @@ def init_db():
             username TEXT NOT NULL
         );""")
 
+        # Match the hot lookups: one group's history, one pair's history and
+        # the groups a user belongs to. The group index is partial, so the
+        # planner cannot pick it for private chats even before ANALYZE; those
+        # are one idx_messages_pair search per direction.
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_group_receiver
+            ON messages (receiver, id) WHERE is_group=1;""")
+
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_pair
+            ON messages (sender, receiver, is_group);""")
+
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_group_members_user
+            ON group_members (username, group_id);""")
+
+        # Full-text index over messages.msg, kept in sync by triggers. Built
+        # from the existing rows the first time it is created.
+        fts_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_fts'"
+        ).fetchone()
+        conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            msg, content='messages', content_rowid='id', prefix='2 3'
+        );""")
+
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, msg) VALUES (new.id, new.msg);
+        END;""")
+
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, msg) VALUES ('delete', old.id, old.msg);
+        END;""")
+
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF msg ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, msg) VALUES ('delete', old.id, old.msg);
+            INSERT INTO messages_fts (rowid, msg) VALUES (new.id, new.msg);
+        END;""")
+
+        if not fts_exists:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
         conn.commit()
+        # Gathers statistics where they are missing or stale; cheap otherwise.
+        conn.execute("PRAGMA optimize;")
 
 # ---------------------- JSON FUNCTIONS ---------------------- #
-def load_data():
+_held_locks = threading.local()
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    # Advisory flock on `path`.lock, shared or exclusive, across threads and
+    # processes. Re-entrant per thread: taking a lock this thread already holds
+    # (or a shared one under an exclusive one) is a no-op. Upgrading a shared
+    # lock to exclusive is not allowed.
+    held = _held_locks.__dict__.setdefault("modes", {})
+    mode = held.get(path)
+    if mode == "exclusive" or (mode == "shared" and not exclusive):
+        yield
+        return
+    if mode == "shared":
+        raise RuntimeError(f"Cannot upgrade shared lock on {path}")
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held[path] = "exclusive" if exclusive else "shared"
+        try:
+            yield
+        finally:
+            del held[path]
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def write_file_atomic(path, text):
+    # Readers see either the old file or the complete new one, even if we
+    # crash part way through. `text` may also be bytes.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def parse_log(chunk):
+    messages = []
+    for line in chunk.splitlines():
+        try:
+            messages.append(json.loads(line))
+        except json.JSONDecodeError:
+            # A torn append from a crashed writer; the rest of the log is intact.
+            continue
+    return messages
+
+def read_messages_log(offset=0):
+    # Returns the messages after `offset` and the offset just past the last
+    # complete line, so a line still being appended is picked up next time.
+    if not os.path.exists(MESSAGES_FILE):
+        return [], 0
+    with open(MESSAGES_FILE, "rb") as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1
+    return parse_log(chunk[:end]), offset + end
+
+def read_messages_snapshot():
+    if not os.path.exists(MESSAGES_SNAPSHOT_FILE):
+        return 0, []
+    with open(MESSAGES_SNAPSHOT_FILE, "r") as f:
+        snapshot = json.load(f)
+    return snapshot["last_id"], [dict(zip(MESSAGE_FIELDS, row)) for row in snapshot["rows"]]
+
+def append_message_log(message):
+    append_messages_log([message])
+
+def append_messages_log(messages):
+    # All lines go out in a single write.
+    line = "".join(json.dumps(m, separators=(",", ":")) + "\n" for m in messages)
+    with file_lock(MESSAGES_FILE), open(MESSAGES_FILE, "a+b") as f:
+        # Start on a fresh line if the previous append was cut short.
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = "\n" + line
+        f.write(line.encode())
+
+def migrate_inline_messages(data):
+    # Files written before the message log kept messages inside DATA_FILE.
+    # Rewrite the log as inline + logged messages (deduplicated by id, so a
+    # crash half way through is safe to repeat), then drop them from DATA_FILE.
+    inline = data.pop("messages")
+    merged = {message_id_json(inline, i): dict(m, id=message_id_json(inline, i)) for i, m in enumerate(inline)}
+    for m in read_messages_log()[0]:
+        merged.setdefault(m["id"], m)
+    with file_lock(MESSAGES_FILE):
+        write_file_atomic(MESSAGES_FILE, "".join(
+            json.dumps(merged[mid], separators=(",", ":")) + "\n" for mid in sorted(merged)
+        ))
+    save_data(data)
+
+def file_key(path):
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (info.st_ino, info.st_size, info.st_mtime_ns)
+
+@st.cache_resource
+def get_data_cache(data_file):
+    # Parsed JSON store shared by every session in the process, one per
+    # absolute DATA_FILE path. Entries are validated against (inode, size,
+    # mtime) before each use.
+    return {
+        "lock": threading.RLock(),
+        "data_key": None,
+        "data": None,
+        "snapshot_key": None,
+        "log_ino": None,
+        "log_offset": 0,
+        "messages": [],
+        "index": {}
+    }
+
+def conversation_key(a, b, is_group):
+    # A private chat is the same conversation whichever side is asking.
+    return ("group", b) if is_group else ("pair",) + tuple(sorted((a, b)))
+
+def index_messages(index, messages):
+    for m in messages:
+        index.setdefault(conversation_key(m["sender"], m["receiver"], m["is_group"]), []).append(m)
+
+def cached_messages(cache):
+    snapshot_key = file_key(MESSAGES_SNAPSHOT_FILE)
+    log_key = file_key(MESSAGES_FILE)
+    log_ino = log_key[0] if log_key else None
+    if (snapshot_key != cache["snapshot_key"] or log_ino != cache["log_ino"]
+            or (log_key and log_key[1] < cache["log_offset"])):
+        # Snapshot or log replaced: reload both. Read the log before the
+        # snapshot; compaction replaces the snapshot before it trims the log,
+        # so this order can only see a message twice, never miss it.
+        log, offset = read_messages_log()
+        last_id, messages = read_messages_snapshot()
+        messages.extend(m for m in log if m["id"] > last_id)
+        index = {}
+        index_messages(index, messages)
+        cache.update(snapshot_key=snapshot_key, log_ino=log_ino, log_offset=offset, messages=messages, index=index)
+    elif log_key and log_key[1] > cache["log_offset"]:
+        # Same log, more bytes: parse only the appended tail.
+        log, offset = read_messages_log(cache["log_offset"])
+        messages = cache["messages"]
+        last_id = messages[-1]["id"] if messages else 0
+        new = [m for m in log if m["id"] > last_id]
+        messages.extend(new)
+        index_messages(cache["index"], new)
+        cache["log_offset"] = offset
+    return cache["messages"]
+
+def read_data_file():
     if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w") as f:
-            json.dump({"users": {}, "messages": [], "groups": {}}, f)
+        return {"users": {}, "groups": {}}
     with open(DATA_FILE, "r") as f:
         return json.load(f)
 
+def refresh_data(cache):
+    # Lock order is DATA_FILE, then MESSAGES_FILE, then the cache lock.
+    with file_lock(DATA_FILE, exclusive=False):
+        key, data = file_key(DATA_FILE), read_data_file()
+    if "messages" in data:
+        with file_lock(DATA_FILE):
+            key, data = file_key(DATA_FILE), read_data_file()
+            if "messages" in data:
+                migrate_inline_messages(data)
+                key = file_key(DATA_FILE)
+    with cache["lock"]:
+        cache["data"], cache["data_key"] = data, key
+
+def load_data():
+    # Users and groups are shared with the cache and must not be mutated;
+    # writers go through data_transaction(). "index" maps conversation_key()
+    # to that conversation's messages in id order.
+    cache = get_data_cache(os.path.abspath(DATA_FILE))
+    if cache["data"] is None or file_key(DATA_FILE) != cache["data_key"]:
+        refresh_data(cache)
+    with cache["lock"]:
+        data = cache["data"]
+        messages = cached_messages(cache)
+        return {"users": data["users"], "groups": data["groups"], "messages": messages, "index": cache["index"]}
+
+def load_messages():
+    cache = get_data_cache(os.path.abspath(DATA_FILE))
+    with cache["lock"]:
+        return cached_messages(cache)
+
+@contextmanager
+def data_transaction():
+    # Exclusive read-modify-write of users and groups across processes. Yields
+    # a private copy; save_data() it before leaving the block to commit.
+    with file_lock(DATA_FILE):
+        data = load_data()
+        yield {"users": copy.deepcopy(data["users"]), "groups": copy.deepcopy(data["groups"])}
+
 def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    # Only users and groups live here; messages are appended to MESSAGES_FILE.
+    snapshot = {"users": data["users"], "groups": data["groups"]}
+    with file_lock(DATA_FILE):
+        write_file_atomic(DATA_FILE, json.dumps(snapshot, indent=4))
+        key = file_key(DATA_FILE)
+    cache = get_data_cache(os.path.abspath(DATA_FILE))
+    with cache["lock"]:
+        cache["data"], cache["data_key"] = snapshot, key
+
+# ---------------------- JSON COMPACTION ---------------------- #
+def compact_messages():
+    # Fold everything currently in the log into the snapshot, then swap in a
+    # fresh log holding only what was appended meanwhile. Writers are only
+    # held up for that final swap, which is what pause_ms reports.
+    with file_lock(MESSAGES_SNAPSHOT_FILE):
+        return compact_messages_locked()
+
+def compact_messages_locked():
+    started = monotonic()
+    with file_lock(MESSAGES_FILE):
+        offset = file_size(MESSAGES_FILE)
+    bytes_before = file_size(MESSAGES_SNAPSHOT_FILE) + offset
+
+    last_id, messages = read_messages_snapshot()
+    if offset:
+        with open(MESSAGES_FILE, "rb") as f:
+            head = f.read(offset)
+        for m in parse_log(head):
+            if m["id"] > last_id:
+                messages.append(m)
+                last_id = m["id"]
+    write_file_atomic(MESSAGES_SNAPSHOT_FILE, json.dumps({
+        "last_id": last_id,
+        "compacted_at": str(datetime.datetime.now()),
+        "rows": [[m.get(k) for k in MESSAGE_FIELDS] for m in messages]
+    }, separators=(",", ":")))
+
+    paused = monotonic()
+    with file_lock(MESSAGES_FILE):
+        if os.path.exists(MESSAGES_FILE):
+            with open(MESSAGES_FILE, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+            write_file_atomic(MESSAGES_FILE, tail.decode())
+    pause = monotonic() - paused
+
+    bytes_after = file_size(MESSAGES_SNAPSHOT_FILE) + file_size(MESSAGES_FILE)
+    return {
+        "messages": len(messages),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_reclaimed": bytes_before - bytes_after,
+        "pause_ms": round(pause * 1000, 3),
+        "duration_ms": round((monotonic() - started) * 1000, 3)
+    }
+
+def compaction_due(max_bytes=COMPACT_LOG_BYTES, max_age=COMPACT_MAX_AGE):
+    size = file_size(MESSAGES_FILE)
+    if size == 0:
+        return False
+    if size >= max_bytes:
+        return True
+    last = os.path.getmtime(MESSAGES_SNAPSHOT_FILE) if os.path.exists(MESSAGES_SNAPSHOT_FILE) else 0
+    return datetime.datetime.now().timestamp() - last >= max_age
+
+def maybe_compact():
+    if compaction_due():
+        return compact_messages()
+    return None
+
+@st.cache_resource
+def start_compactor(interval=COMPACT_CHECK_INTERVAL):
+    # One daemon thread per process; set the returned event to stop it. It
+    # also persists the search index once enough messages are memory-only.
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                report = maybe_compact()
+            except (OSError, ValueError) as e:
+                logger.warning("JSON compaction failed: %s", e)
+                continue
+            if report:
+                logger.info("JSON compaction: %s", report)
+            try:
+                report = flush_search_index(SEARCH_INDEX_FLUSH)
+            except (OSError, ValueError) as e:
+                logger.warning("Search index flush failed: %s", e)
+                continue
+            if report:
+                logger.info("Search index flush: %s", report)
+
+    threading.Thread(target=run, name="json-compactor", daemon=True).start()
+    return stop
 
 # ---------------------- AUTH FUNCTIONS ---------------------- #
 def hash_password(password):
@@ -80,57 +715,29 @@ def signup_sql(username, password):
             return False
 
 def login_sql(username, password):
+    # Only checks the password; who is online is tracked by Presence.
     with get_conn() as conn:
         row = conn.execute(
             "SELECT id FROM users WHERE username=? AND password_hash=?",
             (username, hash_password(password))
         ).fetchone()
-        if row:
-            conn.execute("UPDATE users SET online=1 WHERE username=?", (username,))
-            conn.commit()
-            return True
-    return False
-
-def logout_sql(username):
-    with get_conn() as conn:
-        conn.execute("UPDATE users SET online=0 WHERE username=?", (username,))
-        conn.commit()
-
-def get_online_users_sql():
-    with get_conn() as conn:
-        return [row[0] for row in conn.execute("SELECT username FROM users WHERE online=1").fetchall()]
+    return row is not None
 
 # ---- JSON ----
 def signup_json(username, password):
-    data = load_data()
-    if username in data["users"]:
-        return False
-    data["users"][username] = {
-        "password_hash": hash_password(password),
-        "online": 0,
-        "created_at": str(datetime.datetime.now())
-    }
-    save_data(data)
-    return True
-
-def login_json(username, password):
-    data = load_data()
-    user = data["users"].get(username)
-    if user and user["password_hash"] == hash_password(password):
-        data["users"][username]["online"] = 1
+    with data_transaction() as data:
+        if username in data["users"]:
+            return False
+        data["users"][username] = {
+            "password_hash": hash_password(password),
+            "created_at": str(datetime.datetime.now())
+        }
         save_data(data)
         return True
-    return False
-
-def logout_json(username):
-    data = load_data()
-    if username in data["users"]:
-        data["users"][username]["online"] = 0
-        save_data(data)
 
-def get_online_users_json():
-    data = load_data()
-    return [u for u, info in data["users"].items() if info["online"] == 1]
+def login_json(username, password):
+    user = load_data()["users"].get(username)
+    return user is not None and user["password_hash"] == hash_password(password)
 
 # ---------------------- CHAT FUNCTIONS ---------------------- #
 # ---- SQLite ----
@@ -142,6 +749,16 @@ def send_message_sql(sender, receiver, msg, is_group=0):
         )
         conn.commit()
 
+def send_messages_sql(messages):
+    # Bulk insert of (sender, receiver, msg, is_group) tuples in one transaction.
+    now = str(datetime.datetime.now())
+    with get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO messages (sender, receiver, msg, time, is_group) VALUES (?, ?, ?, ?, ?)",
+            [(sender, receiver, msg, now, is_group) for sender, receiver, msg, is_group in messages]
+        )
+        conn.commit()
+
 def get_conversation_sql(a, b, is_group=0):
     with get_conn() as conn:
         if is_group:
@@ -151,34 +768,124 @@ def get_conversation_sql(a, b, is_group=0):
             ).fetchall()
             return rows
         else:
+            # One index search per direction, merged in id order without a
+            # sort (a chat with yourself is only read once).
+            rows = conn.execute("""
+                SELECT id, sender, receiver, msg, time FROM messages
+                WHERE sender=? AND receiver=? AND is_group=0
+                UNION ALL
+                SELECT id, sender, receiver, msg, time FROM messages
+                WHERE sender=? AND receiver=? AND is_group=0 AND sender<>receiver
+                ORDER BY id ASC;
+            """, (a, b, b, a)).fetchall()
+            return [row[1:] for row in rows]
+
+def get_conversation_page_sql(a, b, is_group=0, limit=CHAT_PAGE_SIZE, before_id=None):
+    # Keyset pagination: the newest `limit` messages with id < before_id,
+    # returned oldest first with the id as the leading column.
+    before_id = SQLITE_MAX_ID if before_id is None else before_id
+    with get_conn() as conn:
+        if is_group:
             rows = conn.execute(
-                "SELECT sender, receiver, msg, time FROM messages WHERE is_group=0 AND ((sender=? AND receiver=?) OR (sender=? AND receiver=?)) ORDER BY id ASC",
-                (a, b, b, a)
+                "SELECT id, sender, msg, time FROM messages WHERE is_group=1 AND receiver=? AND id<? ORDER BY id DESC LIMIT ?",
+                (b, before_id, limit)
             ).fetchall()
-            return rows
+        else:
+            # One bounded index search per direction instead of sorting the
+            # whole pair history.
+            rows = conn.execute("""
+                SELECT * FROM (
+                    SELECT id, sender, receiver, msg, time FROM messages
+                    WHERE sender=? AND receiver=? AND is_group=0 AND id<? ORDER BY id DESC LIMIT ?)
+                UNION
+                SELECT * FROM (
+                    SELECT id, sender, receiver, msg, time FROM messages
+                    WHERE sender=? AND receiver=? AND is_group=0 AND id<? ORDER BY id DESC LIMIT ?)
+                ORDER BY id DESC LIMIT ?;
+            """, (a, b, before_id, limit, b, a, before_id, limit, limit)).fetchall()
+        rows.reverse()
+        return rows
+
+def get_conversation_since_sql(a, b, is_group=0, after_id=0):
+    # Only the messages newer than after_id, oldest first.
+    with get_conn() as conn:
+        if is_group:
+            return conn.execute(
+                "SELECT id, sender, msg, time FROM messages WHERE is_group=1 AND receiver=? AND id>? ORDER BY id ASC",
+                (b, after_id)
+            ).fetchall()
+        return conn.execute("""
+            SELECT id, sender, receiver, msg, time FROM messages
+            WHERE sender=? AND receiver=? AND is_group=0 AND id>?
+            UNION
+            SELECT id, sender, receiver, msg, time FROM messages
+            WHERE sender=? AND receiver=? AND is_group=0 AND id>?
+            ORDER BY id ASC;
+        """, (a, b, after_id, b, a, after_id)).fetchall()
 
 # ---- JSON ----
+def message_id_json(messages, i):
+    # Messages written before ids were stored are numbered by position.
+    return messages[i].get("id", i + 1)
+
+def conversation_json(a, b, is_group):
+    return load_data()["index"].get(conversation_key(a, b, is_group), [])
+
+def conversation_row_json(m, is_group):
+    if is_group:
+        return (m["id"], m["sender"], m["msg"], m["time"])
+    return (m["id"], m["sender"], m["receiver"], m["msg"], m["time"])
+
 def send_message_json(sender, receiver, msg, is_group=0):
-    data = load_data()
-    data["messages"].append({
-        "sender": sender,
-        "receiver": receiver,
-        "msg": msg,
-        "time": str(datetime.datetime.now()),
-        "is_group": is_group
-    })
-    save_data(data)
+    # The next id is taken under the log lock, after catching up with every
+    # line already appended, so parallel writers never reuse an id. The cache
+    # indexes the new line the next time load_data() sees the log grow.
+    load_data()
+    with file_lock(MESSAGES_FILE):
+        messages = load_messages()
+        append_message_log({
+            "id": messages[-1]["id"] + 1 if messages else 1,
+            "sender": sender,
+            "receiver": receiver,
+            "msg": msg,
+            "time": str(datetime.datetime.now()),
+            "is_group": is_group
+        })
+    update_search_index()
+
+def send_messages_json(messages):
+    # Bulk append of (sender, receiver, msg, is_group) tuples: one lock, one write.
+    now = str(datetime.datetime.now())
+    load_data()
+    with file_lock(MESSAGES_FILE):
+        existing = load_messages()
+        next_id = existing[-1]["id"] + 1 if existing else 1
+        append_messages_log([{
+            "id": next_id + i,
+            "sender": sender,
+            "receiver": receiver,
+            "msg": msg,
+            "time": now,
+            "is_group": is_group
+        } for i, (sender, receiver, msg, is_group) in enumerate(messages)])
+    update_search_index()
 
 def get_conversation_json(a, b, is_group=0):
-    data = load_data()
+    messages = conversation_json(a, b, is_group)
     if is_group:
-        return [(m["sender"], m["msg"], m["time"]) for m in data["messages"] if m["is_group"] == 1 and m["receiver"] == b]
+        return [(m["sender"], m["msg"], m["time"]) for m in messages]
     else:
-        return [(m["sender"], m["receiver"], m["msg"], m["time"]) for m in data["messages"]
-                if m["is_group"] == 0 and (
-                    (m["sender"] == a and m["receiver"] == b) or
-                    (m["sender"] == b and m["receiver"] == a)
-                )]
+        return [(m["sender"], m["receiver"], m["msg"], m["time"]) for m in messages]
+
+def get_conversation_page_json(a, b, is_group=0, limit=CHAT_PAGE_SIZE, before_id=None):
+    messages = conversation_json(a, b, is_group)
+    end = len(messages) if before_id is None else bisect_left(messages, before_id, key=lambda m: m["id"])
+    return [conversation_row_json(m, is_group) for m in messages[max(end - limit, 0):end]]
+
+def get_conversation_since_json(a, b, is_group=0, after_id=0):
+    messages = conversation_json(a, b, is_group)
+    start = bisect_right(messages, after_id, key=lambda m: m["id"])
+    return [conversation_row_json(m, is_group) for m in messages[start:]]
 
 # ---------------------- GROUP FUNCTIONS ---------------------- #
 # ---- SQLite ----
@@ -206,6 +913,21 @@ def add_member_sql(group_name, username):
             return True
         return False
 
+def add_members_sql(group_name, usernames):
+    # Bulk add in one transaction, skipping existing members. Returns how many were added.
+    with get_conn() as conn:
+        group_id = conn.execute("SELECT id FROM groups WHERE group_name=?", (group_name,)).fetchone()
+        if not group_id:
+            return 0
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT INTO group_members (group_id, username) SELECT ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM group_members WHERE username=? AND group_id=?)",
+            [(group_id[0], u, u, group_id[0]) for u in dict.fromkeys(usernames)]
+        )
+        conn.commit()
+        return conn.total_changes - before
+
 def get_user_groups_sql(username):
     with get_conn() as conn:
         rows = conn.execute("""
@@ -217,141 +939,1521 @@ def get_user_groups_sql(username):
 
 # ---- JSON ----
 def create_group_json(group_name, created_by):
-    data = load_data()
-    if group_name in data["groups"]:
-        return False
-    data["groups"][group_name] = {
-        "created_by": created_by,
-        "created_at": str(datetime.datetime.now()),
-        "members": [created_by]
-    }
-    save_data(data)
-    return True
+    with data_transaction() as data:
+        if group_name in data["groups"]:
+            return False
+        data["groups"][group_name] = {
+            "created_by": created_by,
+            "created_at": str(datetime.datetime.now()),
+            "members": [created_by]
+        }
+        save_data(data)
+        return True
 
 def add_member_json(group_name, username):
-    data = load_data()
-    if group_name in data["groups"]:
-        if username not in data["groups"][group_name]["members"]:
-            data["groups"][group_name]["members"].append(username)
+    with data_transaction() as data:
+        if group_name in data["groups"]:
+            if username not in data["groups"][group_name]["members"]:
+                data["groups"][group_name]["members"].append(username)
+                save_data(data)
+                return True
+        return False
+
+def add_members_json(group_name, usernames):
+    # Bulk add in one load/save cycle. Returns how many were added.
+    with data_transaction() as data:
+        group = data["groups"].get(group_name)
+        if group is None:
+            return 0
+        members = set(group["members"])
+        added = [u for u in dict.fromkeys(usernames) if u not in members]
+        if added:
+            group["members"].extend(added)
             save_data(data)
-            return True
-    return False
+        return len(added)
 
 def get_user_groups_json(username):
     data = load_data()
     return [g for g, info in data["groups"].items() if username in info["members"]]
 
-# ---------------------- STREAMLIT APP ---------------------- #
-st.set_page_config(page_title="💬 Wizzy Chat", page_icon="💬", layout="centered")
-init_db()
+# ---------------------- SEARCH FUNCTIONS ---------------------- #
+def search_terms(query):
+    return re.findall(r"\w+", query.lower())
 
-if "user" not in st.session_state:
-    st.session_state.user = None
-if "backend" not in st.session_state:
-    st.session_state.backend = "SQLite"
+def parse_search_query(query):
+    # [(terms, prefix)]: "quoted words" are a phrase, any other word stands
+    # alone. A word ending in * matches as a prefix, and so does the last
+    # unquoted word while the user is still typing it.
+    clauses = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        terms = tuple(search_terms(phrase or word))
+        if terms:
+            clauses.append((terms, word.endswith("*")))
+    if clauses and not query.rstrip().endswith('"'):
+        clauses[-1] = (clauses[-1][0], True)
+    return clauses
 
-# Sidebar toggle
-st.sidebar.title("⚙️ Settings")
-st.session_state.backend = st.sidebar.radio("Storage Backend", ["SQLite", "JSON"])
+# ---- SQLite ----
+def fts_query(query):
+    # Every clause is quoted so FTS5 syntax in user input is inert.
+    clauses = parse_search_query(query)
+    if not clauses:
+        return None
+    return " ".join('"' + " ".join(terms) + '"' + ("*" if prefix else "") for terms, prefix in clauses)
 
-backend = st.session_state.backend
+def search_messages_sql(username, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    # Best matches first among the user's private chats and groups. Rows are
+    # (id, sender, receiver, is_group, time, snippet) with hits in **bold**.
+    match = fts_query(query)
+    if match is None:
+        return []
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT m.id, m.sender, m.receiver, m.is_group, m.time,
+                   snippet(messages_fts, 0, '**', '**', '…', 12)
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+              AND ((m.is_group = 0 AND (m.sender = ? OR m.receiver = ?))
+                OR (m.is_group = 1 AND m.receiver IN (
+                    SELECT g.group_name FROM groups g
+                    JOIN group_members gm ON g.id = gm.group_id
+                    WHERE gm.username = ?)))
+            ORDER BY rank
+            LIMIT ? OFFSET ?;
+        """, (match, username, username, username, limit, offset)).fetchall()
 
-# ---------------------- LOGIN / SIGNUP ---------------------- #
-if st.session_state.user is None:
-    st.title("🔑 Login / Sign Up")
+# ---- JSON ----
+class SearchIndex:
+    # Term -> ascending message ids. Of the persisted generation only the
+    # sorted term list is kept in memory; posting lists are read from the
+    # postings file when a query needs them and cached in an LRU of at most
+    # `budget` ids. Messages newer than the persisted generation are indexed
+    # into `delta` as they arrive until flush() writes the next generation,
+    # at the latest once the delta holds more than `delta_limit` ids.
+    # Callers hold `lock`.
+    typecode = "I"
 
-    choice = st.radio("Choose:", ["Login", "Sign Up"])
-    username = st.text_input("Username")
-    password = st.text_input("Password", type="password")
+    def __init__(self, path=SEARCH_INDEX_FILE, budget=SEARCH_INDEX_BUDGET, delta_limit=SEARCH_INDEX_DELTA_LIMIT):
+        self.lock = threading.RLock()
+        self.path = path
+        self.budget = budget
+        self.delta_limit = delta_limit
+        self.loaded = False
+        self.key = None
+        self.last_id = 0
+        self.postings_file = None
+        self.postings_fd = None
+        self.terms = []
+        self.counts = array(self.typecode)
+        self.offsets = array("Q")
+        self.cached = OrderedDict()
+        self.cached_ids = 0
+        self.delta = {}
+        self.delta_ids = 0
+        self.delta_last_id = 0
 
-    if choice == "Sign Up":
-        if st.button("Sign Up"):
-            success = signup_sql(username, password) if backend == "SQLite" else signup_json(username, password)
-            if success:
-                st.success("Account created. Please login!")
-            else:
-                st.error("Username already taken!")
-    else:
-        if st.button("Login"):
-            success = login_sql(username, password) if backend == "SQLite" else login_json(username, password)
-            if success:
-                st.session_state.user = username
-                st.rerun()
+    def load(self):
+        # Switch to the persisted generation if a flush (from any process)
+        # replaced it. The postings file stays open, so an older generation
+        # can be deleted under a reader that still uses it.
+        with file_lock(self.path, exclusive=False):
+            key = file_key(self.path)
+            if self.loaded and key == self.key:
+                return
+            header = {"last_id": 0, "postings": None, "terms": [], "counts": []}
+            if key:
+                with open(self.path, "r") as f:
+                    header = json.load(f)
+            postings = os.path.join(os.path.dirname(self.path), header["postings"]) if header["postings"] else None
+            fd = os.open(postings, os.O_RDONLY) if postings else None
+        if self.postings_fd is not None:
+            os.close(self.postings_fd)
+        self.loaded, self.key = True, key
+        self.last_id, self.postings_file, self.postings_fd = header["last_id"], postings, fd
+        self.terms = header["terms"]
+        self.counts = array(self.typecode, header["counts"])
+        self.offsets = array("Q", [0])
+        for count in self.counts:
+            self.offsets.append(self.offsets[-1] + count * self.counts.itemsize)
+        self.cached.clear()
+        self.cached_ids = 0
+        # Keep only what the new generation does not cover yet.
+        self.delta = {t: ids[bisect_right(ids, self.last_id):] for t, ids in self.delta.items()}
+        self.delta = {t: ids for t, ids in self.delta.items() if ids}
+        self.delta_ids = sum(map(len, self.delta.values()))
+        self.delta_last_id = max(self.delta_last_id, self.last_id)
+
+    def update(self, messages):
+        # Index what is new in the id-ordered list from load_messages().
+        start = bisect_right(messages, self.delta_last_id, key=lambda m: m["id"])
+        for m in messages[start:]:
+            terms = set(search_terms(m["msg"]))
+            for term in terms:
+                self.delta.setdefault(term, []).append(m["id"])
+            self.delta_ids += len(terms)
+        if start < len(messages):
+            self.delta_last_id = messages[-1]["id"]
+
+    def flush_if_full(self):
+        # Keeps the delta bounded between compactor flushes.
+        if self.delta_ids > self.delta_limit:
+            return self.flush()
+        return None
+
+    def read(self, i):
+        ids = array(self.typecode)
+        ids.frombytes(os.pread(self.postings_fd, self.counts[i] * ids.itemsize, self.offsets[i]))
+        return ids
+
+    def persisted(self, term):
+        i = bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return ()
+        ids = self.cached.get(term)
+        if ids is not None:
+            self.cached.move_to_end(term)
+            return ids
+        ids = self.read(i)
+        self.cached[term] = ids
+        self.cached_ids += len(ids)
+        while self.cached_ids > self.budget and len(self.cached) > 1:
+            self.cached_ids -= len(self.cached.popitem(last=False)[1])
+        return ids
+
+    def ids(self, term):
+        return set(self.persisted(term)).union(self.delta.get(term, ()))
+
+    def expand(self, prefix):
+        # Every known term starting with `prefix`.
+        terms = self.terms[bisect_left(self.terms, prefix):bisect_left(self.terms, prefix + "\U0010ffff")]
+        return set(terms).union(t for t in self.delta if t.startswith(prefix))
+
+    def candidates(self, terms, prefix):
+        # Ids of messages holding every word of a clause (the last one as a
+        # prefix if asked); word order is left to the caller to check.
+        found = None
+        for n, term in enumerate(terms):
+            words = self.expand(term) if prefix and n == len(terms) - 1 else (term,)
+            ids = set().union(*(self.ids(w) for w in words))
+            found = ids if found is None else found & ids
+            if not found:
+                break
+        return found
+
+    def flush(self):
+        # Merge the persisted lists with the delta into a new generation:
+        # stream the postings file, then atomically replace the term list
+        # that points at it. Nothing to do if the delta is empty.
+        with file_lock(self.path):
+            self.load()
+            if self.delta_last_id <= self.last_id:
+                return None
+            name = os.path.join(os.path.dirname(self.path), SEARCH_POSTINGS_FILE.format(self.delta_last_id))
+            terms = sorted(set(self.terms).union(self.delta))
+            counts = array(self.typecode)
+            with open(name, "wb") as f:
+                for term in terms:
+                    i = bisect_left(self.terms, term)
+                    ids = self.read(i) if i < len(self.terms) and self.terms[i] == term else array(self.typecode)
+                    ids.extend(self.delta.get(term, ()))
+                    ids.tofile(f)
+                    counts.append(len(ids))
+                f.flush()
+                os.fsync(f.fileno())
+            write_file_atomic(self.path, json.dumps({
+                "last_id": self.delta_last_id,
+                "postings": os.path.basename(name),
+                "terms": terms,
+                "counts": counts.tolist()
+            }, separators=(",", ":")))
+            old = self.postings_file
+            self.load()
+            if old and old != name and os.path.exists(old):
+                os.remove(old)
+            return {"last_id": self.last_id, "terms": len(terms), "postings": sum(counts)}
+
+@st.cache_resource
+def get_search_index(path):
+    # One per absolute SEARCH_INDEX_FILE path, like get_data_cache().
+    return SearchIndex(path)
+
+def update_search_index():
+    # After a send: keep an index this process already searches current
+    # without waiting for the next query.
+    index = get_search_index(os.path.abspath(SEARCH_INDEX_FILE))
+    with index.lock:
+        if index.loaded:
+            index.update(load_messages())
+            index.flush_if_full()
+
+def flush_search_index(min_pending=0):
+    # Persist the index once at least `min_pending` messages are not in the
+    # persisted generation. Returns a report, or None if nothing was written.
+    started = monotonic()
+    index = get_search_index(os.path.abspath(SEARCH_INDEX_FILE))
+    messages = load_messages()
+    with index.lock:
+        index.load()
+        pending = len(messages) - bisect_right(messages, index.last_id, key=lambda m: m["id"])
+        if pending == 0 or pending < min_pending:
+            return None
+        index.update(messages)
+        report = index.flush()
+    if report:
+        report.update(indexed=pending, duration_ms=round((monotonic() - started) * 1000, 3))
+    return report
+
+def phrase_positions(tokens, terms, prefix):
+    # Where the words of a clause occur in order in `tokens`.
+    n, head, last = len(terms), list(terms[:-1]), terms[-1]
+    return [
+        i for i in range(len(tokens) - n + 1)
+        if tokens[i:i + n - 1] == head and (tokens[i + n - 1].startswith(last) if prefix else tokens[i + n - 1] == last)
+    ]
+
+def search_snippet(text, clauses, size=12):
+    # Like FTS5 snippet(): about `size` words around the first hit, hits in **bold**.
+    words = list(re.finditer(r"\w+", text))
+    tokens = [w.group().lower() for w in words]
+    hits = set()
+    for terms, prefix in clauses:
+        for i in phrase_positions(tokens, terms, prefix):
+            hits.update(range(i, i + len(terms)))
+    start = max(min(min(hits, default=0) - 2, len(words) - size), 0)
+    end = min(start + size, len(words))
+    pos = words[start].start() if start else 0
+    parts = ["…"] if start else []
+    for i in range(start, end):
+        w = words[i]
+        # Consecutive hits share one pair of markers, as FTS5 does for phrases.
+        opens = i in hits and (i == start or i - 1 not in hits)
+        closes = i in hits and (i == end - 1 or i + 1 not in hits)
+        parts.append(text[pos:w.start()] + ("**" if opens else "") + w.group() + ("**" if closes else ""))
+        pos = w.end()
+    parts.append(text[pos:] if end == len(words) else "…")
+    return "".join(parts)
+
+def search_weight(total, matching):
+    # BM25 idf of a clause found in `matching` of `total` messages.
+    return math.log(1 + (total - matching + 0.5) / (matching + 0.5))
+
+def search_score(tokens, clauses, weights):
+    # BM25-style score (no length normalisation), or None unless every
+    # clause occurs in `tokens`.
+    score = 0.0
+    for (terms, prefix), weight in zip(clauses, weights):
+        tf = len(phrase_positions(tokens, terms, prefix))
+        if not tf:
+            return None
+        score += weight * tf * 2.2 / (tf + 1.2)
+    return score
+
+def search_rows(scored, clauses, limit, offset):
+    # scored: [(score, message)], best first and newest first on ties.
+    scored.sort(key=lambda hit: (-hit[0], -hit[1]["id"]))
+    return [
+        (m["id"], m["sender"], m["receiver"], m["is_group"], m["time"], search_snippet(m["msg"], clauses))
+        for _, m in scored[offset:offset + limit]
+    ]
+
+def search_messages_json(username, query, limit=SEARCH_PAGE_SIZE, offset=0):
+    # Same rows as search_messages_sql. The index narrows the candidates to
+    # messages holding every word; phrases are then checked against the text
+    # and hits ranked by a BM25-style score (no length normalisation).
+    clauses = parse_search_query(query)
+    if not clauses:
+        return []
+    data = load_data()
+    messages = data["messages"]
+    my_groups = {g for g, info in data["groups"].items() if username in info["members"]}
+    index = get_search_index(os.path.abspath(SEARCH_INDEX_FILE))
+    with index.lock:
+        index.load()
+        index.update(messages)
+        index.flush_if_full()
+        # Ids are sequential, so the newest one is the message count.
+        total = index.delta_last_id
+        found = None
+        weights = []
+        for terms, prefix in clauses:
+            ids = index.candidates(terms, prefix)
+            weights.append(search_weight(total, len(ids)))
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+
+    scored = []
+    for mid in found:
+        i = bisect_left(messages, mid, key=lambda m: m["id"])
+        if i == len(messages) or messages[i]["id"] != mid:
+            continue
+        m = messages[i]
+        if m["is_group"]:
+            if m["receiver"] not in my_groups:
+                continue
+        elif username not in (m["sender"], m["receiver"]):
+            continue
+        score = search_score(search_terms(m["msg"]), clauses, weights)
+        if score is not None:
+            scored.append((score, m))
+    return search_rows(scored, clauses, limit, offset)
+
+# ---------------------- JSON TO SQLITE MIGRATION ---------------------- #
+MIGRATION_BATCH = 10000
+MIGRATION_CHUNK = 1 << 16
+
+class JSONStream:
+    # Incremental reader for one top-level JSON object. Members are decoded
+    # one value at a time, and arrays listed in `stream_keys` one element at
+    # a time, so memory is bounded by the largest single value.
+    def __init__(self, f, chunk=MIGRATION_CHUNK):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        data = self.f.read(size)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        self.eof = not data
+        return bool(data)
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill(self.chunk):
+                return self.buf[self.pos:self.pos + 1]
+
+    def _expect(self, ch):
+        if self._peek() != ch:
+            raise ValueError(f"Expected {ch!r} in JSON stream, got {self._peek()!r}")
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        size = self.chunk
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number may continue past the end of the buffer.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+    def items(self, stream_keys=()):
+        # Yields (key, value), or (key, element) per element for stream_keys.
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key in stream_keys and self._peek() == "[":
+                self.pos += 1
+                if self._peek() != "]":
+                    while True:
+                        yield key, self._value()
+                        if self._peek() != ",":
+                            break
+                        self.pos += 1
+                self._expect("]")
             else:
-                st.error("Invalid username/password.")
+                yield key, self._value()
+            if self._peek() != ",":
+                break
+            self.pos += 1
+        self._expect("}")
+
+def iter_json_messages():
+    # Every JSON-backend message in id order, without loading the store:
+    # inline messages of an unmigrated DATA_FILE, then the snapshot, then the log.
+    if os.path.exists(DATA_FILE):
+        with open(DATA_FILE, "r") as f:
+            for i, (key, m) in enumerate(v for v in JSONStream(f).items({"messages"}) if v[0] == "messages"):
+                yield dict(m, id=m.get("id", i + 1))
+    last_id = 0
+    if os.path.exists(MESSAGES_SNAPSHOT_FILE):
+        with open(MESSAGES_SNAPSHOT_FILE, "r") as f:
+            for key, value in JSONStream(f).items({"rows"}):
+                if key == "last_id":
+                    last_id = value
+                elif key == "rows":
+                    yield dict(zip(MESSAGE_FIELDS, value))
+    if os.path.exists(MESSAGES_FILE):
+        with open(MESSAGES_FILE, "rb") as f:
+            for line in f:
+                for m in parse_log(line):
+                    if m["id"] > last_id:
+                        yield m
+
+def migration_progress(conn, key, default=0):
+    row = conn.execute("SELECT value FROM migration_progress WHERE key=?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_migration_progress(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO migration_progress (key, value) VALUES (?, ?)", (key, value))
+
+def migrate_json_to_sqlite(batch_size=MIGRATION_BATCH, report=print):
+    # Copies the JSON store into DB_FILE. Users, groups and members are
+    # idempotent upserts; messages are inserted in id order, and the last
+    # copied JSON id is committed with each batch, so an interrupted run
+    # resumes where it stopped. Returns the verification counts.
+    init_db()
+    with get_conn() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS migration_progress (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    counts = {"users": 0, "groups": 0, "members": 0, "messages": 0}
+    users, groups = {}, {}
+    if os.path.exists(DATA_FILE):
+        with open(DATA_FILE, "r") as f:
+            for key, value in JSONStream(f).items({"messages"}):
+                if key == "users":
+                    users = value
+                elif key == "groups":
+                    groups = value
+    with get_conn() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (username, password_hash, online, created_at) VALUES (?, ?, ?, ?)",
+            [(u, info["password_hash"], info.get("online", 0), info["created_at"]) for u, info in users.items()]
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO groups (group_name, created_by, created_at) VALUES (?, ?, ?)",
+            [(g, info["created_by"], info["created_at"]) for g, info in groups.items()]
+        )
+    for g, info in groups.items():
+        add_members_sql(g, info["members"])
+    counts["users"], counts["groups"] = len(users), len(groups)
+    counts["members"] = sum(len(set(info["members"])) for info in groups.values())
+    report(f"Users: {counts['users']}, groups: {counts['groups']}, memberships: {counts['members']}")
+
+    with get_conn() as conn:
+        done_id = migration_progress(conn, "messages_last_id")
+    if done_id:
+        report(f"Resuming after JSON message id {done_id}")
+    batch = []
+    last_id = done_id
+
+    def flush():
+        with get_conn() as conn:
+            conn.executemany(
+                "INSERT INTO messages (sender, receiver, msg, time, is_group) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+            set_migration_progress(conn, "messages_last_id", last_id)
+            set_migration_progress(conn, "messages_copied", migration_progress(conn, "messages_copied") + len(batch))
+        report(f"Messages copied up to JSON id {last_id}")
+        batch.clear()
+
+    seen = 0
+    for m in iter_json_messages():
+        if m["id"] <= seen:
+            # The log also holds inline messages whose migration was interrupted.
+            continue
+        seen = m["id"]
+        counts["messages"] += 1
+        if m["id"] <= done_id:
+            continue
+        batch.append((m["sender"], m["receiver"], m["msg"], m["time"], m["is_group"]))
+        last_id = m["id"]
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return verify_migration(users, groups, counts, report)
+
+def verify_migration(users, groups, counts, report):
+    problems = []
+    with get_conn() as conn:
+        names = list(users)
+        found = 0
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            found += conn.execute(
+                f"SELECT COUNT(*) FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchone()[0]
+        if found != counts["users"]:
+            problems.append(f"users: {found} of {counts['users']} present")
+        members = 0
+        for g in groups:
+            members += conn.execute("""
+                SELECT COUNT(DISTINCT gm.username) FROM group_members gm
+                JOIN groups g ON g.id = gm.group_id WHERE g.group_name=?
+            """, (g,)).fetchone()[0]
+        if members < counts["members"]:
+            problems.append(f"memberships: {members} of {counts['members']} present")
+        copied = migration_progress(conn, "messages_copied")
+        if copied != counts["messages"]:
+            problems.append(f"messages: {copied} copied, {counts['messages']} in JSON")
+    for problem in problems:
+        report(f"MISMATCH {problem}")
+    report("Verified." if not problems else "Verification failed.")
+    return dict(counts, ok=not problems)
+
+# ---------------------- PRESENCE ---------------------- #
+class Presence:
+    # username -> expiry time, kept in expiry order (every heartbeat moves the
+    # user to the end) so a sweep stops at the first live entry. With a
+    # `path`, this process's heartbeats and logouts are merged into that file
+    # at most every PRESENCE_SYNC_INTERVAL seconds, and other processes' users
+    # are read back from it. One map per store name.
+    def __init__(self, name, ttl=PRESENCE_TTL, path=PRESENCE_FILE):
+        self.lock = threading.Lock()
+        self.name = name
+        self.ttl = ttl
+        self.path = path
+        self.local = OrderedDict()
+        self.left = set()
+        self.remote = {}
+        self.synced = 0.0
+
+    def heartbeat(self, username):
+        with self.lock:
+            self.local.pop(username, None)
+            self.local[username] = wall_clock() + self.ttl
+            self.left.discard(username)
+
+    def leave(self, username):
+        with self.lock:
+            self.local.pop(username, None)
+            self.remote.pop(username, None)
+            if self.path:
+                self.left.add(username)
+        if self.path:
+            self.sync()
+
+    def sweep(self, now):
+        while self.local:
+            expires = next(iter(self.local.values()))
+            if expires > now:
+                break
+            self.local.popitem(last=False)
+
+    def online(self):
+        now = wall_clock()
+        if self.path and now - self.synced >= PRESENCE_SYNC_INTERVAL:
+            self.sync()
+        with self.lock:
+            self.sweep(now)
+            users = list(self.local)
+            users.extend(u for u, expires in self.remote.items() if expires > now and u not in self.local)
+            return users
+
+    def sync(self):
+        with self.lock:
+            local, left = dict(self.local), set(self.left)
+        with file_lock(self.path):
+            shared = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    shared = json.load(f)
+            now = wall_clock()
+            users = {u: expires for u, expires in shared.get(self.name, {}).items() if expires > now and u not in left}
+            for u, expires in local.items():
+                users[u] = max(expires, users.get(u, 0))
+            shared[self.name] = users
+            write_file_atomic(self.path, json.dumps(shared))
+        with self.lock:
+            self.remote = users
+            self.left -= left
+            self.synced = now
+
+@st.cache_resource
+def get_presence(name, root):
+    # Stores live in files under the working directory, so presence is kept
+    # per (store, directory).
+    return Presence(name)
+
+# ---------------------- STORAGE BACKENDS ---------------------- #
+# Every operation a store offers. The UI only talks to a StorageBackend, so
+# wrappers (caching, batching, instrumentation) can be stacked on any store.
+STORAGE_OPERATIONS = (
+    "signup", "login", "logout", "heartbeat", "get_online_users",
+    "send_message", "send_messages", "get_conversation", "get_conversation_page", "get_conversation_since",
+    "create_group", "add_member", "add_members", "get_user_groups", "search_messages"
+)
+
+class StorageBackend(abc.ABC):
+    # A store must implement every operation; a missing one fails when the
+    # backend is built, not when the UI first calls it.
+    name = None
+
+    def setup(self):
+        pass
+
+    @abc.abstractmethod
+    def signup(self, username, password):
+        pass
+
+    @abc.abstractmethod
+    def login(self, username, password):
+        pass
+
+    # Presence is the same for every store: in memory, never in storage.
+    @functools.cached_property
+    def presence(self):
+        # Looked up once per store; the cache_resource call is not free.
+        return get_presence(self.name, os.getcwd())
+
+    def logout(self, username):
+        self.presence.leave(username)
+
+    def heartbeat(self, username):
+        self.presence.heartbeat(username)
+
+    def get_online_users(self):
+        return self.presence.online()
+
+    @abc.abstractmethod
+    def send_message(self, sender, receiver, msg, is_group=0):
+        pass
+
+    @abc.abstractmethod
+    def send_messages(self, messages):
+        pass
+
+    @abc.abstractmethod
+    def get_conversation(self, a, b, is_group=0):
+        pass
+
+    @abc.abstractmethod
+    def get_conversation_page(self, a, b, is_group=0, limit=CHAT_PAGE_SIZE, before_id=None):
+        pass
+
+    @abc.abstractmethod
+    def get_conversation_since(self, a, b, is_group=0, after_id=0):
+        pass
+
+    @abc.abstractmethod
+    def create_group(self, group_name, created_by):
+        pass
+
+    @abc.abstractmethod
+    def add_member(self, group_name, username):
+        pass
+
+    @abc.abstractmethod
+    def add_members(self, group_name, usernames):
+        pass
+
+    @abc.abstractmethod
+    def search_messages(self, username, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        pass
+
+    @abc.abstractmethod
+    def get_user_groups(self, username):
+        pass
+
+class SQLiteBackend(StorageBackend):
+    name = "SQLite"
+    setup = staticmethod(init_db)
+    signup = staticmethod(signup_sql)
+    login = staticmethod(login_sql)
+    send_message = staticmethod(send_message_sql)
+    send_messages = staticmethod(send_messages_sql)
+    get_conversation = staticmethod(get_conversation_sql)
+    get_conversation_page = staticmethod(get_conversation_page_sql)
+    get_conversation_since = staticmethod(get_conversation_since_sql)
+    create_group = staticmethod(create_group_sql)
+    add_member = staticmethod(add_member_sql)
+    add_members = staticmethod(add_members_sql)
+    get_user_groups = staticmethod(get_user_groups_sql)
+    search_messages = staticmethod(search_messages_sql)
+
+class JSONBackend(StorageBackend):
+    name = "JSON"
+    setup = staticmethod(start_compactor)
+    signup = staticmethod(signup_json)
+    login = staticmethod(login_json)
+    send_message = staticmethod(send_message_json)
+    send_messages = staticmethod(send_messages_json)
+    get_conversation = staticmethod(get_conversation_json)
+    get_conversation_page = staticmethod(get_conversation_page_json)
+    get_conversation_since = staticmethod(get_conversation_since_json)
+    create_group = staticmethod(create_group_json)
+    add_member = staticmethod(add_member_json)
+    add_members = staticmethod(add_members_json)
+    get_user_groups = staticmethod(get_user_groups_json)
+    search_messages = staticmethod(search_messages_json)
+
+class BackendWrapper(StorageBackend):
+    # Forwards every operation to `inner`; subclasses override what they wrap.
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = inner.name
+
+    def setup(self):
+        self.inner.setup()
+
+def _forward(op):
+    def forward(self, *args, **kwargs):
+        return getattr(self.inner, op)(*args, **kwargs)
+    forward.__name__ = op
+    return forward
+
+for _op in STORAGE_OPERATIONS:
+    setattr(BackendWrapper, _op, _forward(_op))
+abc.update_abstractmethods(BackendWrapper)
+
+class MemoryBackend(StorageBackend):
+    # Process-local store with the same semantics as the JSON functions and
+    # no disk I/O, for tests and as a baseline in benchmarks. Messages are
+    # kept per conversation in id order, so lookups use bisect like the JSON
+    # index does.
+    name = "Memory"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+        self.groups = {}
+        self.user_groups = {}
+        self.conversations = {}
+        self.last_id = 0
+
+    def signup(self, username, password):
+        with self.lock:
+            if username in self.users:
+                return False
+            self.users[username] = {
+                "password_hash": hash_password(password),
+                "created_at": str(datetime.datetime.now())
+            }
+            return True
+
+    def login(self, username, password):
+        with self.lock:
+            user = self.users.get(username)
+            return user is not None and user["password_hash"] == hash_password(password)
+
+    def send_message(self, sender, receiver, msg, is_group=0):
+        self.send_messages([(sender, receiver, msg, is_group)])
+
+    def send_messages(self, messages):
+        now = str(datetime.datetime.now())
+        with self.lock:
+            for sender, receiver, msg, is_group in messages:
+                self.last_id += 1
+                message = (self.last_id, sender, receiver, msg, now, is_group)
+                self.conversations.setdefault(conversation_key(sender, receiver, is_group), []).append(message)
+
+    def _rows(self, messages, is_group):
+        if is_group:
+            return [(mid, sender, msg, time) for mid, sender, _, msg, time, _ in messages]
+        return [(mid, sender, receiver, msg, time) for mid, sender, receiver, msg, time, _ in messages]
+
+    def get_conversation(self, a, b, is_group=0):
+        with self.lock:
+            messages = list(self.conversations.get(conversation_key(a, b, is_group), ()))
+        return [row[1:] for row in self._rows(messages, is_group)]
+
+    def get_conversation_page(self, a, b, is_group=0, limit=CHAT_PAGE_SIZE, before_id=None):
+        with self.lock:
+            messages = self.conversations.get(conversation_key(a, b, is_group), [])
+            end = len(messages) if before_id is None else bisect_left(messages, (before_id,))
+            page = messages[max(end - limit, 0):end]
+        return self._rows(page, is_group)
+
+    def get_conversation_since(self, a, b, is_group=0, after_id=0):
+        with self.lock:
+            messages = self.conversations.get(conversation_key(a, b, is_group), [])
+            delta = messages[bisect_left(messages, (after_id + 1,)):]
+        return self._rows(delta, is_group)
+
+    def create_group(self, group_name, created_by):
+        with self.lock:
+            if group_name in self.groups:
+                return False
+            self.groups[group_name] = {
+                "created_by": created_by,
+                "created_at": str(datetime.datetime.now()),
+                "members": [created_by]
+            }
+            self.user_groups.setdefault(created_by, {})[group_name] = None
+            return True
+
+    def add_member(self, group_name, username):
+        return self.add_members(group_name, [username]) == 1
+
+    def add_members(self, group_name, usernames):
+        with self.lock:
+            group = self.groups.get(group_name)
+            if group is None:
+                return 0
+            added = 0
+            for username in usernames:
+                if group_name not in self.user_groups.get(username, {}):
+                    group["members"].append(username)
+                    self.user_groups.setdefault(username, {})[group_name] = None
+                    added += 1
+            return added
+
+    def get_user_groups(self, username):
+        with self.lock:
+            return list(self.user_groups.get(username, {}))
+
+    def search_messages(self, username, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        # Same rows as search_messages_json, from a scan of the conversations
+        # the user can read; clause weights count matches among those.
+        clauses = parse_search_query(query)
+        if not clauses:
+            return []
+        with self.lock:
+            keys = [("group", g) for g in self.user_groups.get(username, {})]
+            keys += [key for key in self.conversations if key[0] == "pair" and username in key[1:]]
+            messages = [m for key in keys for m in self.conversations.get(key, ())]
+        tokens = [search_terms(m[3]) for m in messages]
+        weights = [
+            search_weight(len(messages), sum(1 for t in tokens if phrase_positions(t, terms, prefix)))
+            for terms, prefix in clauses
+        ]
+        scored = []
+        for (mid, sender, receiver, msg, time, is_group), t in zip(messages, tokens):
+            score = search_score(t, clauses, weights)
+            if score is not None:
+                message = {"id": mid, "sender": sender, "receiver": receiver, "msg": msg, "time": time, "is_group": is_group}
+                scored.append((score, message))
+        return search_rows(scored, clauses, limit, offset)
+
+@st.cache_resource
+def shared_memory_backend():
+    # One in-memory store per process so every session sees the same chats.
+    return MemoryBackend()
+
+BACKENDS = {
+    "SQLite": SQLiteBackend,
+    "JSON": JSONBackend,
+    "Memory": shared_memory_backend
+}
+
+def make_backend(name):
+    backend = BACKENDS[name]()
+    if WRITE_BEHIND_ENABLED and name == "SQLite":
+        backend = WriteBehindBackend(backend, get_message_writer())
+    backend = PublishingBackend(backend, get_message_bus())
+    backend = CachedBackend(backend, get_group_cache(name, os.getcwd()))
+    if METRICS_ENABLED:
+        backend = InstrumentedBackend(backend, get_metrics())
+    backend.setup()
+    return backend
+
+# ---------------------- METRICS ---------------------- #
+class Metrics:
+    # Per (backend, operation): calls, errors, total seconds, rows returned
+    # and a cumulative latency histogram over LATENCY_BUCKETS.
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.ops = {}
+
+    def observe(self, backend, op, seconds, rows=None, error=False):
+        with self.lock:
+            stats = self.ops.get((backend, op))
+            if stats is None:
+                stats = self.ops[(backend, op)] = {
+                    "calls": 0, "errors": 0, "seconds": 0.0, "rows": 0,
+                    "buckets": [0] * len(self.buckets)
+                }
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["seconds"] += seconds
+            stats["rows"] += rows or 0
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(stats, buckets=list(stats["buckets"])) for key, stats in self.ops.items()}
+
+    def quantile(self, stats, q):
+        # Upper bound of the bucket holding the q-th call; None if it is past the last bucket.
+        target = q * stats["calls"]
+        for bound, count in zip(self.buckets, stats["buckets"]):
+            if count >= target:
+                return bound
+        return None
+
+    def hottest(self, n=10):
+        rows = []
+        for (backend, op), stats in self.snapshot().items():
+            p95 = self.quantile(stats, 0.95)
+            rows.append({
+                "operation": f"{backend}.{op}",
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "total ms": round(stats["seconds"] * 1000, 1),
+                "avg ms": round(stats["seconds"] / stats["calls"] * 1000, 3),
+                "p95 ms": f"{p95 * 1000:g}" if p95 is not None else f">{self.buckets[-1] * 1000:g}",
+                "rows": stats["rows"]
+            })
+        rows.sort(key=lambda r: r["total ms"], reverse=True)
+        return rows[:n]
+
+    def prometheus_text(self):
+        ops = sorted(self.snapshot().items())
+        out = []
+        for name, kind, help_text, field in (
+            ("chat_storage_calls_total", "counter", "Storage operations called.", "calls"),
+            ("chat_storage_errors_total", "counter", "Storage operations that raised.", "errors"),
+            ("chat_storage_rows_total", "counter", "Rows returned by storage operations.", "rows")
+        ):
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (backend, op), stats in ops:
+                out.append(f'{name}{{backend="{backend}",operation="{op}"}} {stats[field]}')
+        name = "chat_storage_latency_seconds"
+        out += [f"# HELP {name} Storage operation latency.", f"# TYPE {name} histogram"]
+        for (backend, op), stats in ops:
+            labels = f'backend="{backend}",operation="{op}"'
+            for bound, count in zip(self.buckets, stats["buckets"]):
+                out.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+            out.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats["calls"]}')
+            out.append(f"{name}_sum{{{labels}}} {stats['seconds']:.6f}")
+            out.append(f"{name}_count{{{labels}}} {stats['calls']}")
+        return "\n".join(out) + "\n"
 
-else:
-    st.sidebar.title(f"Welcome {st.session_state.user} 👋")
-    if st.sidebar.button("Logout"):
-        if backend == "SQLite":
-            logout_sql(st.session_state.user)
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+class InstrumentedBackend(BackendWrapper):
+    # Times every operation of `inner` into `metrics`.
+    def __init__(self, inner, metrics):
+        super().__init__(inner)
+        self.metrics = metrics
+
+def _instrument(op):
+    def call(self, *args, **kwargs):
+        started = perf_counter()
+        try:
+            result = getattr(self.inner, op)(*args, **kwargs)
+        except Exception:
+            self.metrics.observe(self.name, op, perf_counter() - started, error=True)
+            raise
+        rows = len(result) if isinstance(result, list) else None
+        self.metrics.observe(self.name, op, perf_counter() - started, rows)
+        return result
+    call.__name__ = op
+    return call
+
+for _op in STORAGE_OPERATIONS:
+    setattr(InstrumentedBackend, _op, _instrument(_op))
+
+def dump_metrics(path=METRICS_FILE):
+    write_file_atomic(path, get_metrics().prometheus_text())
+
+@st.cache_resource
+def start_metrics_exporters(port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_DUMP_INTERVAL):
+    # Serves /metrics on 127.0.0.1:port and/or rewrites `path` every
+    # `interval` seconds, whichever is configured. Once per process.
+    if port:
+        metrics = get_metrics()
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as e:
+            # Typically another app process already serves this port.
+            logger.warning("Not serving metrics on port %s: %s", port, e)
         else:
-            logout_json(st.session_state.user)
-        st.session_state.user = None
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+    if path:
+        def run():
+            while True:
+                try:
+                    dump_metrics(path)
+                except OSError as e:
+                    logger.warning("Writing %s failed: %s", path, e)
+                sleep(interval)
+
+        threading.Thread(target=run, name="metrics-file", daemon=True).start()
+    return True
+
+# ---------------------- WRITE-BEHIND ---------------------- #
+class MessageWriter:
+    # Single background thread that drains queued messages into one
+    # executemany + commit per batch. submit() returns a Future that resolves
+    # once the row's batch has committed (or carries the error if it failed).
+    def __init__(self, max_batch=WRITE_BEHIND_BATCH, max_delay=WRITE_BEHIND_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = queue.Queue()
+        self.batches = 0
+        self.rows = 0
+        threading.Thread(target=self._run, name="message-writer", daemon=True).start()
+
+    def submit(self, sender, receiver, msg, is_group=0):
+        future = concurrent.futures.Future()
+        self.pending.put(((sender, receiver, msg, str(datetime.datetime.now()), is_group), future))
+        return future
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        deadline = monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - monotonic()
+            try:
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Rows whose sender gave up waiting were cancelled; skip them.
+            batch = [(row, future) for row, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                with get_conn() as conn:
+                    conn.executemany(
+                        "INSERT INTO messages (sender, receiver, msg, time, is_group) VALUES (?, ?, ?, ?, ?)",
+                        [row for row, _ in batch]
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += len(batch)
+            for _, future in batch:
+                future.set_result(True)
+
+@st.cache_resource
+def get_message_writer():
+    return MessageWriter()
+
+class WriteBehindBackend(BackendWrapper):
+    # Sends through the shared MessageWriter and waits for the commit, so a
+    # message only shows as sent once it is durable.
+    def __init__(self, inner, writer):
+        super().__init__(inner)
+        self.writer = writer
+
+    def send_message(self, sender, receiver, msg, is_group=0):
+        future = self.writer.submit(sender, receiver, msg, is_group)
+        try:
+            future.result(timeout=WRITE_BEHIND_ACK_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Withdraw the row so a message reported as failed is not written
+            # later. Once its batch is running it can no longer be cancelled,
+            # so wait for that commit instead.
+            if future.cancel():
+                raise
+            future.result()
+
+# ---------------------- SHARED CACHE ---------------------- #
+class GroupCache:
+    # username -> (groups, expiry), shared by every session on one store. A
+    # lookup that raced with an invalidation is returned but not kept.
+    def __init__(self, ttl=GROUP_CACHE_TTL):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.entries = {}
+        self.generation = 0
+
+    def get(self, username, load):
+        now = monotonic()
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry and entry[1] > now:
+                return list(entry[0])
+            generation = self.generation
+        groups = load(username)
+        with self.lock:
+            if generation == self.generation:
+                self.entries[username] = (tuple(groups), now + self.ttl)
+        return groups
+
+    def invalidate(self, *usernames):
+        with self.lock:
+            self.generation += 1
+            for username in usernames:
+                self.entries.pop(username, None)
+
+@st.cache_resource
+def get_group_cache(name, root):
+    # Per (store, directory), like get_presence().
+    return GroupCache()
+
+class CachedBackend(BackendWrapper):
+    # Serves get_user_groups from the shared GroupCache and drops the entries
+    # of whoever a create_group or add_member(s) through this store affects.
+    def __init__(self, inner, cache):
+        super().__init__(inner)
+        self.cache = cache
+
+    def get_user_groups(self, username):
+        return self.cache.get(username, self.inner.get_user_groups)
+
+    def create_group(self, group_name, created_by):
+        created = self.inner.create_group(group_name, created_by)
+        if created:
+            self.cache.invalidate(created_by)
+        return created
+
+    def add_member(self, group_name, username):
+        added = self.inner.add_member(group_name, username)
+        if added:
+            self.cache.invalidate(username)
+        return added
+
+    def add_members(self, group_name, usernames):
+        # The inner store may consume an iterator; keep the names to invalidate.
+        usernames = list(usernames)
+        added = self.inner.add_members(group_name, usernames)
+        if added:
+            self.cache.invalidate(*usernames)
+        return added
+
+# ---------------------- MESSAGE BUS ---------------------- #
+def message_topic(store_name, sender, receiver, is_group):
+    # One topic per private conversation and per group, on each store.
+    return (store_name,) + conversation_key(sender, receiver, is_group)
+
+class MessageBus:
+    # Topic -> version, bumped by every publish. Subscribers remember the
+    # version they last acted on, so checking for news costs a dict lookup.
+    def __init__(self, directory=BUS_DIR):
+        self.lock = threading.Lock()
+        self.versions = {}
+        self.transport = SocketTransport(directory, self.deliver) if directory else None
+
+    def deliver(self, topic):
+        with self.lock:
+            self.versions[topic] = self.versions.get(topic, 0) + 1
+
+    def publish(self, topic):
+        self.deliver(topic)
+        if self.transport:
+            self.transport.send(topic)
+
+    def version(self, topic):
+        with self.lock:
+            return self.versions.get(topic, 0)
+
+    def subscribe(self, topic):
+        return Subscription(self, topic)
+
+class Subscription:
+    def __init__(self, bus, topic):
+        self.bus = bus
+        self.topic = topic
+        self.seen = bus.version(topic)
+        self.synced = monotonic()
+
+    def poll(self):
+        # True if anything was published since the last poll. Without a
+        # cross-process transport it is also True every BUS_RESYNC_INTERVAL.
+        version = self.bus.version(self.topic)
+        now = monotonic()
+        if version == self.seen and (self.bus.transport or now - self.synced < BUS_RESYNC_INTERVAL):
+            return False
+        self.seen, self.synced = version, now
+        return True
+
+class SocketTransport:
+    # One datagram socket per bus in `directory`. Publishes go to every other
+    # socket there without blocking (a receiver that is backed up misses
+    # them); a listener thread passes what arrives to `deliver`. A process
+    # removes its own socket on exit; sockets left by processes that died are
+    # removed when a send to them is refused.
+    def __init__(self, directory, deliver):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}-{id(self):x}.sock")
+        self.deliver = deliver
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        atexit.register(self.close)
+        threading.Thread(target=self.listen, name="message-bus", daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def listen(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                # Closed by close().
+                return
+            try:
+                self.deliver(tuple(json.loads(data)))
+            except (ValueError, TypeError):
+                logger.warning("Ignoring malformed message bus datagram")
+
+    def send(self, topic):
+        data = json.dumps(topic).encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or path == self.path:
+                continue
+            try:
+                self.sock.sendto(data, socket.MSG_DONTWAIT, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                if os.path.exists(path):
+                    os.remove(path)
+            except BlockingIOError:
+                logger.warning("Message bus receiver %s is backed up; dropped %s", name, topic)
+
+@st.cache_resource
+def get_message_bus():
+    return MessageBus()
+
+class PublishingBackend(BackendWrapper):
+    # Publishes the topic of every message once the store has accepted it.
+    def __init__(self, inner, bus):
+        super().__init__(inner)
+        self.bus = bus
+
+    def send_message(self, sender, receiver, msg, is_group=0):
+        self.inner.send_message(sender, receiver, msg, is_group)
+        self.bus.publish(message_topic(self.name, sender, receiver, is_group))
+
+    def send_messages(self, messages):
+        self.inner.send_messages(messages)
+        for topic in dict.fromkeys(message_topic(self.name, s, r, g) for s, r, _, g in messages):
+            self.bus.publish(topic)
+
+# ---------------------- STREAMLIT APP ---------------------- #
+def load_history(store, a, b, is_group=0):
+    # Rows already fetched by this session are kept in history_cache; a rerun
+    # only asks storage for messages newer than the last one we have, and
+    # only once the conversation's bus topic says there are any. Rows carry
+    # the message id first.
+    chat_key = (store.name, a, b, is_group)
+    cached = st.session_state.history_cache.get(chat_key)
+    if cached is None:
+        # Subscribe before reading, so a message sent in between is not missed.
+        updates = get_message_bus().subscribe(message_topic(store.name, a, b, is_group))
+        page = store.get_conversation_page(a, b, is_group=is_group)
+        cached = {"rows": page, "more": len(page) == CHAT_PAGE_SIZE, "updates": updates}
+        st.session_state.history_cache[chat_key] = cached
+    elif cached["updates"].poll():
+        last_id = cached["rows"][-1][0] if cached["rows"] else 0
+        delta = store.get_conversation_since(a, b, is_group, last_id)
+        cached["rows"].extend(delta)
+    if cached["more"] and cached["rows"]:
+        st.button("⬆️ Load older messages", on_click=load_older, args=(store, a, b, is_group, cached))
+    return cached["rows"]
+
+def load_older(store, a, b, is_group, cached):
+    # Button callbacks run before the rerun they trigger, so the rows they
+    # add are drawn by that rerun without another one.
+    older = store.get_conversation_page(a, b, is_group, before_id=cached["rows"][0][0])
+    cached["rows"] = older + cached["rows"]
+    cached["more"] = len(older) == CHAT_PAGE_SIZE
+
+def send_from_input(store, a, b, is_group):
+    new_msg = st.session_state.new_msg
+    if new_msg.strip():
+        store.send_message(a, b, new_msg, is_group=is_group)
+        st.session_state.new_msg = ""
+
+@st.fragment(run_every=CHAT_REFRESH_INTERVAL)
+def show_conversation(store, a, b, is_group=0):
+    # Reruns on its own every CHAT_REFRESH_INTERVAL seconds; a tick goes to
+    # storage only if the message bus has news for this conversation, and
+    # then only for messages newer than the last one shown. Buttons in here
+    # rerun just this pane, not the page.
+    history = load_history(store, a, b, is_group)
+    for row in history:
+        sender, msg, time = row[1], row[-2], row[-1]
+        align = "➡️" if sender == a else "⬅️"
+        st.write(f"{align} **{sender}**: {msg} ({time})")
+
+    st.text_input("Type a message...", key="new_msg")
+    st.button("Send", on_click=send_from_input, args=(store, a, b, is_group))
+
+def show_search(store, username):
+    # Search box in the sidebar, ranked results a page at a time above the chat.
+    query = st.sidebar.text_input("🔍 Search messages", key="search_query").strip()
+    if not query:
+        return
+    if st.session_state.get("search_for") != query:
+        st.session_state.search_for = query
+        st.session_state.search_page = 0
+    page = st.session_state.search_page
+    # One extra row tells us whether there is a next page.
+    results = store.search_messages(username, query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE)
+
+    st.subheader(f"🔍 Results for \"{query}\"")
+    if not results:
+        st.write("No matching messages.")
+    for _, sender, receiver, is_group, time, snippet in results[:SEARCH_PAGE_SIZE]:
+        where = f"📌 {receiver}" if is_group else f"{sender} → {receiver}"
+        st.write(f"{where} · **{sender}**: {snippet} ({time})")
+    previous_col, next_col = st.columns(2)
+    if page > 0 and previous_col.button("⬅️ Previous results"):
+        st.session_state.search_page -= 1
+        st.rerun()
+    if len(results) > SEARCH_PAGE_SIZE and next_col.button("More results ➡️"):
+        st.session_state.search_page += 1
         st.rerun()
+    st.divider()
 
-    online_users = get_online_users_sql() if backend == "SQLite" else get_online_users_json()
-    st.sidebar.subheader("🟢 Online Users")
-    for u in online_users:
-        if u != st.session_state.user:
-            st.sidebar.write(u)
-
-    my_groups = get_user_groups_sql(st.session_state.user) if backend == "SQLite" else get_user_groups_json(st.session_state.user)
-    st.sidebar.subheader("👥 Groups")
-    for g in my_groups:
-        st.sidebar.write(f"📌 {g}")
-
-    # Chat area
-    chat_mode = st.radio("Chat Mode", ["Private Chat", "Group Chat"])
-
-    if chat_mode == "Private Chat":
-        chat_with = st.selectbox("Select a user", [u for u in online_users if u != st.session_state.user])
-        if chat_with:
-            history = get_conversation_sql(st.session_state.user, chat_with) if backend == "SQLite" else get_conversation_json(st.session_state.user, chat_with)
-            st.subheader(f"Chat with {chat_with}")
-            for sender, receiver, msg, time in history:
-                align = "➡️" if sender == st.session_state.user else "⬅️"
-                st.write(f"{align} **{sender}**: {msg} ({time})")
-
-            new_msg = st.text_input("Type a message...")
-            if st.button("Send"):
-                if new_msg.strip():
-                    if backend == "SQLite":
-                        send_message_sql(st.session_state.user, chat_with, new_msg)
-                    else:
-                        send_message_json(st.session_state.user, chat_with, new_msg)
-                    st.rerun()
+@st.fragment(run_every=PRESENCE_HEARTBEAT)
+def show_online_users(store, username):
+    # Reruns on its own every PRESENCE_HEARTBEAT seconds, which keeps this
+    # session online and the list current without rerunning the whole page.
+    store.heartbeat(username)
+    st.subheader("🟢 Online Users")
+    for u in store.get_online_users():
+        if u != username:
+            st.write(u)
 
-    else:  # Group Chat
-        group_action = st.radio("Choose:", ["Join Group", "Create Group"])
+def main():
+    st.set_page_config(page_title="💬 Wizzy Chat", page_icon="💬", layout="centered")
 
-        if group_action == "Create Group":
-            group_name = st.text_input("Group Name")
-            if st.button("Create Group"):
-                created = create_group_sql(group_name, st.session_state.user) if backend == "SQLite" else create_group_json(group_name, st.session_state.user)
-                if created:
-                    if backend == "SQLite":
-                        add_member_sql(group_name, st.session_state.user)
-                    else:
-                        add_member_json(group_name, st.session_state.user)
-                    st.success(f"Group '{group_name}' created!")
+    if "user" not in st.session_state:
+        st.session_state.user = None
+    if "backend" not in st.session_state:
+        st.session_state.backend = "SQLite"
+    if "history_cache" not in st.session_state:
+        st.session_state.history_cache = {}
+
+    # Sidebar toggle
+    st.sidebar.title("⚙️ Settings")
+    st.session_state.backend = st.sidebar.radio("Storage Backend", list(BACKENDS))
+
+    start_metrics_exporters()
+    if st.sidebar.checkbox("📊 Show storage metrics"):
+        st.sidebar.dataframe(get_metrics().hottest(), hide_index=True)
+
+    # Resolved once per session (and again only if the radio changes).
+    if st.session_state.get("store") is None or st.session_state.store.name != st.session_state.backend:
+        st.session_state.store = make_backend(st.session_state.backend)
+    store = st.session_state.store
+
+    # ---------------------- LOGIN / SIGNUP ---------------------- #
+    if st.session_state.user is None:
+        st.title("🔑 Login / Sign Up")
+
+        choice = st.radio("Choose:", ["Login", "Sign Up"])
+        username = st.text_input("Username")
+        password = st.text_input("Password", type="password")
+
+        if choice == "Sign Up":
+            if st.button("Sign Up"):
+                success = store.signup(username, password)
+                if success:
+                    st.success("Account created. Please login!")
                 else:
-                    st.error("Group already exists!")
+                    st.error("Username already taken!")
         else:
-            group_list = get_user_groups_sql(st.session_state.user) if backend == "SQLite" else get_user_groups_json(st.session_state.user)
-            group_choice = st.selectbox("Select Group", group_list)
-            if group_choice:
-                history = get_conversation_sql(st.session_state.user, group_choice, is_group=1) if backend == "SQLite" else get_conversation_json(st.session_state.user, group_choice, is_group=1)
-                st.subheader(f"Group Chat: {group_choice}")
-                for sender, msg, time in history:
-                    align = "➡️" if sender == st.session_state.user else "⬅️"
-                    st.write(f"{align} **{sender}**: {msg} ({time})")
-
-                new_msg = st.text_input("Type a message...")
-                if st.button("Send"):
-                    if new_msg.strip():
-                        if backend == "SQLite":
-                            send_message_sql(st.session_state.user, group_choice, new_msg, is_group=1)
-                        else:
-                            send_message_json(st.session_state.user, group_choice, new_msg, is_group=1)
-                        st.rerun()
+            if st.button("Login"):
+                success = store.login(username, password)
+                if success:
+                    st.session_state.user = username
+                    st.rerun()
+                else:
+                    st.error("Invalid username/password.")
+
+    else:
+        st.sidebar.title(f"Welcome {st.session_state.user} 👋")
+        if st.sidebar.button("Logout"):
+            store.logout(st.session_state.user)
+            st.session_state.user = None
+            # Nothing fetched for this user may show to the next one.
+            st.session_state.history_cache = {}
+            for key in ("search_query", "search_for", "search_page"):
+                st.session_state.pop(key, None)
+            st.rerun()
+
+        with st.sidebar:
+            show_online_users(store, st.session_state.user)
+
+        my_groups = store.get_user_groups(st.session_state.user)
+        st.sidebar.subheader("👥 Groups")
+        for g in my_groups:
+            st.sidebar.write(f"📌 {g}")
+
+        show_search(store, st.session_state.user)
+
+        # Chat area
+        chat_mode = st.radio("Chat Mode", ["Private Chat", "Group Chat"])
+
+        if chat_mode == "Private Chat":
+            online_users = store.get_online_users()
+            chat_with = st.selectbox("Select a user", [u for u in online_users if u != st.session_state.user])
+            if chat_with:
+                st.subheader(f"Chat with {chat_with}")
+                show_conversation(store, st.session_state.user, chat_with)
+
+        else:  # Group Chat
+            group_action = st.radio("Choose:", ["Join Group", "Create Group"])
+
+            if group_action == "Create Group":
+                group_name = st.text_input("Group Name")
+                if st.button("Create Group"):
+                    created = store.create_group(group_name, st.session_state.user)
+                    if created:
+                        store.add_member(group_name, st.session_state.user)
+                        st.success(f"Group '{group_name}' created!")
+                    else:
+                        st.error("Group already exists!")
+            else:
+                group_choice = st.selectbox("Select Group", my_groups)
+                if group_choice:
+                    st.subheader(f"Group Chat: {group_choice}")
+                    show_conversation(store, st.session_state.user, group_choice, is_group=1)
+
+# ---------------------- CLI ---------------------- #
+def cli(argv):
+    parser = argparse.ArgumentParser(
+        prog="chat.py",
+        description="Maintenance commands for the chat stores. Start the app with `streamlit run chat.py`."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact = commands.add_parser("compact", help="fold the JSON message log into its snapshot")
+    compact.add_argument("--if-due", action="store_true", help="only compact when a size or age trigger has fired")
+
+    commands.add_parser("index-search", help="build or update the JSON backend's search index")
+
+    migrate = commands.add_parser("migrate-json", help="copy the JSON store into the SQLite database (resumable)")
+    migrate.add_argument("--batch", type=int, default=MIGRATION_BATCH, help="messages per transaction")
+
+    args = parser.parse_args(argv)
+    if args.command == "compact":
+        report = maybe_compact() if args.if_due else compact_messages()
+        print(json.dumps(report) if report else "Compaction not due.")
+    elif args.command == "index-search":
+        report = flush_search_index()
+        print(json.dumps(report) if report else "Search index is up to date.")
+    elif args.command == "migrate-json":
+        result = migrate_json_to_sqlite(args.batch)
+        print(json.dumps(result))
+        return 0 if result["ok"] else 1
+    return 0
+
+if __name__ == "__main__":
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(cli(sys.argv[1:]))
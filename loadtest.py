@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from time import monotonic, perf_counter, sleep
+
+import chat
+
+# ---------------------- TIMING ---------------------- #
+def timed(samples, op, fn, *args, **kwargs):
+    started = perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        samples.setdefault(op, []).append(perf_counter() - started)
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def merge_samples(into, samples):
+    for op, values in samples.items():
+        into.setdefault(op, []).extend(values)
+
+def stats(values, wall):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "ops_per_sec": round(len(values) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3)
+    }
+
+def summarize(samples, wall):
+    # Operations share the wall time, so an operation's ops_per_sec is its
+    # share of the phase's throughput; "total" is the phase as a whole.
+    report = {op: stats(values, wall) for op, values in sorted(samples.items())}
+    report["total"] = stats([v for values in samples.values() for v in values], wall)
+    return report
+
+# ---------------------- SCENARIO ---------------------- #
+def user_name(i):
+    return f"user{i}"
+
+def group_name(i):
+    return f"group{i}"
+
+def group_members(args, g):
+    # Group g takes `group_size` consecutive users, wrapping around.
+    return [user_name((g * args.group_size + k) % args.users) for k in range(min(args.group_size, args.users))]
+
+def setup_groups(store, args, samples):
+    # The shared groups exist before the run so group messages start at once.
+    for g in range(args.groups):
+        members = group_members(args, g)
+        timed(samples, "create_group", store.create_group, group_name(g), members[0])
+        for member in members:
+            timed(samples, "add_member", store.add_member, group_name(g), member)
+
+def simulate_user(store, args, i, samples):
+    # One chat session: sign up, log in and open a group with a few random
+    # peers. Then each "rerun" heartbeats and reads the sidebar, sends one
+    # message to a random peer or one of the user's groups, and reads that
+    # conversation.
+    rng = random.Random(args.seed + i)
+    me = user_name(i)
+    timed(samples, "signup", store.signup, me, "password")
+    timed(samples, "login", store.login, me, "password")
+    room = f"room{i}"
+    peers = [user_name(p) for p in rng.sample(range(args.users), min(args.group_size, args.users)) if p != i]
+    timed(samples, "create_group", store.create_group, room, me)
+    for member in [me] + peers[:args.group_size - 1]:
+        timed(samples, "add_member", store.add_member, room, member)
+
+    interval = 1 / args.rate if args.rate else 0
+    for n in range(args.messages):
+        started = monotonic()
+        timed(samples, "heartbeat", store.heartbeat, me)
+        timed(samples, "get_online_users", store.get_online_users)
+        my_groups = timed(samples, "get_user_groups", store.get_user_groups, me)
+        if my_groups and rng.random() < args.group_ratio:
+            target, is_group = rng.choice(my_groups), 1
+        else:
+            target, is_group = user_name(rng.randrange(args.users)), 0
+        timed(samples, "send_message", store.send_message, me, target, f"message {n} from {me}", is_group=is_group)
+        timed(samples, "get_conversation_page", store.get_conversation_page, me, target, is_group=is_group)
+        if interval:
+            sleep(max(interval - (monotonic() - started), 0))
+
+def run_threads(store, args, user_ids):
+    samples = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(ids):
+        local = {}
+        try:
+            for i in ids:
+                simulate_user(store, args, i, local)
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            merge_samples(samples, local)
+
+    threads = [threading.Thread(target=worker, args=(user_ids[t::args.threads],)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        # A partial table would look like a valid result; fail the run instead.
+        raise errors[0]
+    return samples
+
+def run_process(backend, workdir, args, user_ids):
+    # Times its own run, so process start-up is not counted as load.
+    os.chdir(workdir)
+    store = chat.make_backend(backend)
+    started = monotonic()
+    samples = run_threads(store, args, user_ids)
+    return samples, monotonic() - started
+
+def run_backend(backend, args):
+    workdir = tempfile.mkdtemp(prefix=f"loadtest-{backend.lower()}-", dir=args.workdir)
+    os.chdir(workdir)
+    store = chat.make_backend(backend)
+
+    setup_samples = {}
+    started = monotonic()
+    setup_groups(store, args, setup_samples)
+    setup_wall = monotonic() - started
+
+    user_ids = list(range(args.users))
+    if args.processes == 1:
+        started = monotonic()
+        samples = run_threads(store, args, user_ids)
+        wall = monotonic() - started
+    else:
+        samples = {}
+        wall = 0.0
+        # Spawned, not forked: the parent's pooled SQLite connections and
+        # background threads (write-behind, compactor) must not be inherited.
+        with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+            jobs = [(backend, workdir, args, user_ids[p::args.processes]) for p in range(args.processes)]
+            for result, process_wall in pool.starmap(run_process, jobs):
+                merge_samples(samples, result)
+                wall = max(wall, process_wall)
+
+    return {
+        "backend": backend,
+        "workdir": workdir,
+        "setup": summarize(setup_samples, setup_wall),
+        "run": summarize(samples, wall),
+        "wall_sec": round(wall, 3)
+    }
+
+# ---------------------- CLI ---------------------- #
+def print_report(result):
+    print(f"\n== {result['backend']} ({result['wall_sec']}s, data in {result['workdir']})")
+    # ops/s per operation is its share of the phase; see summarize().
+    print(f"{'operation':<24}{'count':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for phase in ("setup", "run"):
+        for op, row in result[phase].items():
+            label = f"{phase} total" if op == "total" else op
+            print(f"{label:<24}{row['count']:>8}{row['ops_per_sec']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat users against the storage backends.")
+    parser.add_argument("--backend", nargs="+", default=["SQLite", "JSON"], choices=list(chat.BACKENDS))
+    parser.add_argument("--users", type=int, default=20, help="simulated users")
+    parser.add_argument("--messages", type=int, default=20, help="messages sent by each user")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second per user (0 = as fast as possible)")
+    parser.add_argument("--groups", type=int, default=4, help="groups created before the run")
+    parser.add_argument("--group-size", type=int, default=10, help="members added to each group (fan-out)")
+    parser.add_argument("--group-ratio", type=float, default=0.5, help="share of messages sent to a group")
+    parser.add_argument("--threads", type=int, default=4, help="threads per process")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="parent directory for the per-run data files")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+    if args.processes > 1 and "Memory" in args.backend:
+        parser.error("the Memory backend cannot be shared between processes; use --processes 1")
+
+    results = [run_backend(backend, args) for backend in args.backend]
+    for result in results:
+        print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import threading
+
+import chat
+
+PROCESSES = 4
+THREADS = 3
+MESSAGES = 100
+
+
+def writer(workdir, n):
+    # One process: a user and a group of its own, then THREADS threads
+    # sending to a shared group and adding members to another.
+    os.chdir(workdir)
+    assert chat.signup_json(f"user{n}", "password")
+    assert chat.create_group_json(f"group{n}", f"user{n}")
+
+    def send(t):
+        for i in range(MESSAGES):
+            chat.send_message_json(f"user{n}", "room", f"{n}-{t}-{i}", is_group=1)
+            if i % 25 == 0:
+                assert chat.add_member_json("shared", f"member{n}-{t}-{i}")
+
+    threads = [threading.Thread(target=send, args=(t,)) for t in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def compactor(workdir, stop):
+    os.chdir(workdir)
+    while not stop.is_set():
+        chat.compact_messages()
+
+
+def test_concurrent_writers_and_compaction_lose_nothing(workdir):
+    assert chat.create_group_json("shared", "owner")
+    spawn = multiprocessing.get_context("spawn")
+    stop = spawn.Event()
+    compacting = spawn.Process(target=compactor, args=(str(workdir), stop))
+    compacting.start()
+    writers = [spawn.Process(target=writer, args=(str(workdir), n)) for n in range(PROCESSES)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+    stop.set()
+    compacting.join()
+    assert [p.exitcode for p in writers + [compacting]] == [0] * (PROCESSES + 1)
+
+    data = chat.load_data()
+    ids = [m["id"] for m in data["messages"]]
+    assert ids == list(range(1, PROCESSES * THREADS * MESSAGES + 1))
+    assert {m["msg"] for m in data["messages"]} == {
+        f"{n}-{t}-{i}" for n in range(PROCESSES) for t in range(THREADS) for i in range(MESSAGES)
+    }
+    assert set(data["users"]) == {f"user{n}" for n in range(PROCESSES)}
+    assert set(data["groups"]) == {"shared"} | {f"group{n}" for n in range(PROCESSES)}
+    assert len(data["groups"]["shared"]["members"]) == 1 + PROCESSES * THREADS * (MESSAGES // 25)
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import chat
+
+INLINE = 7
+LOGGED = 3
+BATCH = 3
+
+
+class Interrupted(Exception):
+    pass
+
+
+def message(i, is_group):
+    return {"sender": "alice", "receiver": "team" if is_group else "bob", "msg": f"message {i}", "time": "t", "is_group": is_group}
+
+
+@pytest.fixture(params=[False, True], ids=["legacy", "upgrade-interrupted"])
+def legacy_store(request, workdir):
+    # A chat_data.json from before the message log, with its messages inline.
+    # If an upgrade was cut short, the log already repeats them as well.
+    inline = [message(i, i % 2) for i in range(INLINE)]
+    with open(chat.DATA_FILE, "w") as f:
+        json.dump({
+            "users": {u: {"password_hash": chat.hash_password("pw"), "created_at": "t"} for u in ("alice", "bob")},
+            "groups": {"team": {"created_by": "alice", "created_at": "t", "members": ["alice", "bob", "alice"]}},
+            "messages": inline
+        }, f)
+    logged = [dict(message(i, 0), id=i + 1) for i in range(INLINE, INLINE + LOGGED)]
+    if request.param:
+        logged = [dict(m, id=i + 1) for i, m in enumerate(inline)] + logged
+    chat.append_messages_log(logged)
+    return [m["msg"] for m in inline] + [m["msg"] for m in logged[-LOGGED:]]
+
+
+def interrupt_after_first_batch(line):
+    if line.startswith("Messages copied"):
+        raise Interrupted(line)
+
+
+def sqlite_rows():
+    with chat.get_conn() as conn:
+        messages = [row[0] for row in conn.execute("SELECT msg FROM messages ORDER BY id")]
+        members = conn.execute("SELECT username FROM group_members ORDER BY username").fetchall()
+        users = conn.execute("SELECT username FROM users ORDER BY username").fetchall()
+    return messages, [m[0] for m in members], [u[0] for u in users]
+
+
+def test_interrupted_migration_resumes_without_duplicates(legacy_store):
+    with pytest.raises(Interrupted):
+        chat.migrate_json_to_sqlite(batch_size=BATCH, report=interrupt_after_first_batch)
+    assert sqlite_rows()[0] == legacy_store[:BATCH]
+
+    result = chat.migrate_json_to_sqlite(batch_size=BATCH, report=lambda line: None)
+    assert result["ok"]
+    assert result["messages"] == INLINE + LOGGED
+    assert sqlite_rows() == (legacy_store, ["alice", "bob"], ["alice", "bob"])
+
+    # A run with nothing left to copy changes nothing.
+    assert chat.migrate_json_to_sqlite(batch_size=BATCH, report=lambda line: None)["ok"]
+    assert sqlite_rows() == (legacy_store, ["alice", "bob"], ["alice", "bob"])
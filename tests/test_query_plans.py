@@ -0,0 +1,97 @@
+import re
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import chat
+
+USERS = 50
+GROUPS = 5
+MESSAGES = 5_000
+
+
+@pytest.fixture(params=[False, True], ids=["unanalyzed", "analyzed"])
+def traced(request, workdir, monkeypatch):
+    # A seeded database plus a list that collects every statement the chat
+    # functions run, with parameters inlined so it can be EXPLAINed.
+    monkeypatch.setattr(chat, "DB_FILE", str(workdir / chat.DB_FILE))
+    chat.init_db()
+    with chat.get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO messages (sender, receiver, msg, time, is_group) VALUES (?, ?, ?, ?, ?)",
+            [
+                (f"user{i % USERS}", f"group{i % GROUPS}", f"group message {i}", "t", 1) if i % 2 else
+                (f"user{i % USERS}", f"user{(i * 7) % USERS}", f"private message {i}", "t", 0)
+                for i in range(MESSAGES)
+            ]
+        )
+        for g in range(GROUPS):
+            group_id = conn.execute(
+                "INSERT INTO groups (group_name, created_by, created_at) VALUES (?, 'user0', 't')", (f"group{g}",)
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO group_members (group_id, username) VALUES (?, ?)",
+                [(group_id, f"user{u}") for u in range(g, USERS, GROUPS)]
+            )
+        if request.param:
+            conn.execute("ANALYZE")
+
+    statements = []
+    get_conn = chat.get_conn
+
+    @contextmanager
+    def traced_conn():
+        with get_conn() as conn:
+            conn.set_trace_callback(statements.append)
+            try:
+                yield conn
+            finally:
+                conn.set_trace_callback(None)
+
+    monkeypatch.setattr(chat, "get_conn", traced_conn)
+    return statements
+
+
+def query_plans(statements):
+    conn = sqlite3.connect(chat.DB_FILE)
+    try:
+        return [
+            [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+            for sql in statements if sql.lstrip().upper().startswith("SELECT")
+        ]
+    finally:
+        conn.close()
+
+
+TABLE_SCAN = re.compile(r"SCAN (messages|m|groups|g|group_members|gm|users)( |$)")
+
+
+def assert_uses(plans, index):
+    assert plans
+    for plan in plans:
+        for step in plan:
+            # A full scan of a real table; the FTS5 virtual table is fine.
+            assert not TABLE_SCAN.match(step), plan
+            if step.startswith("SEARCH messages"):
+                assert f"USING INDEX {index} " in step, plan
+
+
+HOT_QUERIES = {
+    "private history": (lambda: chat.get_conversation_sql("user1", "user7"), "idx_messages_pair"),
+    "private page": (lambda: chat.get_conversation_page_sql("user1", "user7"), "idx_messages_pair"),
+    "private older page": (lambda: chat.get_conversation_page_sql("user1", "user7", before_id=5000), "idx_messages_pair"),
+    "private since": (lambda: chat.get_conversation_since_sql("user1", "user7", 0, 5000), "idx_messages_pair"),
+    "group history": (lambda: chat.get_conversation_sql("user1", "group1", 1), "idx_messages_group_receiver"),
+    "group page": (lambda: chat.get_conversation_page_sql("user1", "group1", 1), "idx_messages_group_receiver"),
+    "group since": (lambda: chat.get_conversation_since_sql("user1", "group1", 1, 5000), "idx_messages_group_receiver"),
+    "user groups": (lambda: chat.get_user_groups_sql("user1"), None),
+    "search": (lambda: chat.search_messages_sql("user1", "private"), None)
+}
+
+
+@pytest.mark.parametrize("name", list(HOT_QUERIES))
+def test_hot_queries_use_an_index(traced, name):
+    run, index = HOT_QUERIES[name]
+    run()
+    assert_uses(query_plans(traced), index)
@@ -0,0 +1,63 @@
+import pytest
+
+import chat
+
+STORES = {"SQLite": chat.SQLiteBackend, "JSON": chat.JSONBackend, "Memory": chat.MemoryBackend}
+
+
+@pytest.fixture(params=list(STORES))
+def store(request, workdir):
+    # Backends are used bare: no wrappers and no JSON compactor thread.
+    backend = STORES[request.param]()
+    if request.param == "SQLite":
+        backend.setup()
+    for username in ("alice", "bob", "carol"):
+        backend.signup(username, "pw")
+    backend.create_group("team", "alice")
+    backend.add_members("team", ["alice", "bob"])
+    backend.send_message("alice", "bob", "secret lunch plans")
+    backend.send_message("alice", "team", "release plans for friday", 1)
+    return backend
+
+
+def found(store, username, query):
+    return [(sender, receiver, is_group) for _, sender, receiver, is_group, _, _ in store.search_messages(username, query)]
+
+
+def test_members_find_their_messages(store):
+    assert sorted(found(store, "alice", "plans")) == [("alice", "bob", 0), ("alice", "team", 1)]
+    assert found(store, "bob", "friday") == [("alice", "team", 1)]
+
+
+def test_non_member_gets_no_group_hits(store):
+    assert found(store, "carol", "friday") == []
+    assert found(store, "carol", "plans") == []
+
+
+def test_third_party_gets_no_private_hits(store):
+    assert found(store, "bob", "secret") == [("alice", "bob", 0)]
+    assert found(store, "carol", "secret") == []
+
+
+def test_member_added_later_gets_hits(store):
+    assert store.add_member("team", "carol")
+    # Including messages sent before they joined.
+    store.send_message("bob", "team", "friday works for me", 1)
+    assert sorted(found(store, "carol", "friday")) == [("alice", "team", 1), ("bob", "team", 1)]
+    assert found(store, "carol", "secret") == []
+
+
+def test_snippet_marks_hits(store):
+    (row,) = store.search_messages("bob", '"lunch plans"')
+    assert row[-1] == "secret **lunch plans**"
+
+
+@pytest.mark.parametrize("store", ["SQLite"], indirect=True)
+def test_fts_follows_updates_and_deletes(store):
+    with chat.get_conn() as conn:
+        conn.execute("UPDATE messages SET msg = 'secret dinner plans' WHERE msg = 'secret lunch plans'")
+        conn.execute("DELETE FROM messages WHERE receiver = 'team'")
+        conn.commit()
+    assert found(store, "bob", "lunch") == []
+    assert found(store, "bob", "dinner") == [("alice", "bob", 0)]
+    assert found(store, "bob", "friday") == []
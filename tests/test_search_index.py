@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+
+import chat
+
+# Every message holds three distinct terms, so ten messages put 30 ids in the delta.
+DELTA_LIMIT = 50
+
+
+def messages(start, stop):
+    return [("alice", "bob", f"hello number {i}", 0) for i in range(start, stop)]
+
+
+def postings(workdir):
+    return sorted(p.name for p in workdir.glob("chat_search_index.*.postings"))
+
+
+def search_in(workdir, username, query):
+    # A fresh process: everything it knows comes from the persisted generation.
+    os.chdir(workdir)
+    index = chat.get_search_index(os.path.abspath(chat.SEARCH_INDEX_FILE))
+    ids = [row[0] for row in chat.search_messages_json(username, query, limit=100)]
+    return ids, index.last_id, index.delta_ids
+
+
+def test_delta_is_flushed_past_its_limit(workdir):
+    index = chat.get_search_index(os.path.abspath(chat.SEARCH_INDEX_FILE))
+    index.delta_limit = DELTA_LIMIT
+
+    chat.send_messages_json(messages(0, 10))
+    assert len(chat.search_messages_json("alice", "hello", limit=100)) == 10
+    assert (index.last_id, index.delta_ids) == (0, 30)
+    assert postings(workdir) == []
+
+    # Sends keep an index that is already searched current, and flush it.
+    chat.send_messages_json(messages(10, 20))
+    assert (index.last_id, index.delta_ids) == (20, 0)
+    assert postings(workdir) == ["chat_search_index.20.postings"]
+
+    # The next generation replaces the previous postings file.
+    chat.send_messages_json(messages(20, 40))
+    assert (index.last_id, index.delta_ids) == (40, 0)
+    assert postings(workdir) == ["chat_search_index.40.postings"]
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        ids, last_id, delta_ids = pool.apply(search_in, (str(workdir), "alice", "hello"))
+    assert (last_id, delta_ids) == (40, 0)
+    # Equal scores, so newest first.
+    assert ids == list(range(40, 0, -1))
+    # Message ids start at 1.
+    assert [row[0] for row in chat.search_messages_json("bob", "number 7")] == [8]